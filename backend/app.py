@@ -1,9 +1,31 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import logging
-from routes import contentRoute, videoRoute
+from routes import contentRoute, videoRoute, modelRoute
+from controllers import videoController
+from models import executorModel
+from models.LRNetModel import model_registry
+from models.LRNetModel.utils.detector_pool import init_detector_pool
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    videoController.init_video_cache()
+    # Load the LRNet weights and warm the face detectors once per worker, instead of once per request.
+    # LRNet runs in this process in both modes, the inference processes send it their blocks.
+    model_registry.load_models()
+    if executorModel.INFERENCE_EXECUTOR == "thread":
+        init_detector_pool()
+    else:
+        # The detectors live in the inference processes, this one never runs them.
+        await run_in_threadpool(executorModel.warm_inference_executor)
+    yield
+    videoController.video_jobs.shutdown()
+    executorModel.io_executor.shutdown()
+    executorModel.inference_executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +40,7 @@ logger = logging.getLogger(__name__)
 
 app.include_router(contentRoute.router, prefix="/api")
 app.include_router(videoRoute.router, prefix="/api")
+app.include_router(modelRoute.router, prefix="/api")
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -1,19 +1,27 @@
 from fastapi import HTTPException
 from models.contentModel import extract_content_newspaper, extract_content_general, get_raw_html
+from models.executorModel import io_executor, ExecutorFullError
+from models.singleFlightModel import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
+content_flights = SingleFlight("extract")
 
 async def extract_content(url: str):
+    # Concurrent requests for the same URL share one extraction.
+    return await content_flights.do(url, _extract_content, url)
+
+async def _extract_content(url: str):
     logger.info(f"嘗試提取 URL: {url}")
     try:
         # 首先嘗試使用 Newspaper3k
-        content = extract_content_newspaper(url)
+        # The extractors are blocking (requests / sleep), run them in the I/O executor.
+        content = await io_executor.run(extract_content_newspaper, url)
         content_source = "newspaper3k"
 
         if not content:
             logger.info("Newspaper3k 提取失敗，嘗試通用方法")
-            content = extract_content_general(url)
+            content = await io_executor.run(extract_content_general, url)
             content_source = "general"
         
         if content:
@@ -21,11 +29,16 @@ async def extract_content(url: str):
             return {"success": True, "content": content, "source": content_source}
         else:
             logger.warning("無法提取結構化內容，嘗試獲取原始 HTML")
-            raw_html = get_raw_html(url)
+            raw_html = await io_executor.run(get_raw_html, url)
             if raw_html:
                 return {"success": True, "content": raw_html, "source": "raw_html"}
             else:
                 raise HTTPException(status_code=404, detail="無法提取內容或獲取原始 HTML")
+    except HTTPException:
+        raise
+    except ExecutorFullError as e:
+        logger.warning(f"執行器已滿: {str(e)}")
+        raise HTTPException(status_code=429, detail=f"伺服器忙碌中，請稍後再試: {str(e)}")
     except Exception as e:
         logger.error(f"提取過程中發生錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,31 @@
+import logging
+from typing import Optional
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from models.LRNetModel import model_registry
+from controllers.videoController import submit_reclassify_job
+
+logger = logging.getLogger(__name__)
+
+
+async def reload_lrnet_models(weights_g1: Optional[str] = None, weights_g2: Optional[str] = None):
+    logger.info(f"重新加載 LRNet 模型: g1={weights_g1}, g2={weights_g2}")
+    try:
+        # LRNet only runs in this process (the inference processes send it their blocks), reloading it here is
+        # enough. Deserializing the weights is blocking, keep it off the event loop.
+        await run_in_threadpool(model_registry.reload_models, weights_g1, weights_g2)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"找不到模型權重: {str(e)}")
+    except Exception as e:
+        logger.exception(f"重新加載模型失敗: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"重新加載模型失敗: {str(e)}")
+    return model_registry.get_status()
+
+
+def get_model_status():
+    return model_registry.get_status()
+
+
+def reclassify_stored_videos():
+    # Runs as a video job, poll GET /api/videoDetect/{job_id} for the result.
+    return submit_reclassify_job()
@@ -7,31 +7,124 @@ import bs4
 from fastapi import HTTPException
 from tqdm import tqdm
 from pathlib import Path
-from models.LRNetModel.classify_pipeline import classify_video
+from models.LRNetModel.classify_pipeline import classify_video, reclassify_stored
+from models.jobModel import JobQueue, QueueFullError
+from models.executorModel import io_executor, inference_executor
+from models.cacheModel import ResultCache, file_sha256
+from models.LRNetModel import model_registry, landmark_store
 
 logging.basicConfig(level=logging.DEBUG)  # 將日誌級別設置為DEBUG
 
-async def extract_video_content_by_id(video_id: str):
+video_jobs = JobQueue()
+video_cache = None
+
+def init_video_cache():
+    """
+    Open the result cache, called by the startup hook (so importing the app does not create the database).
+    """
+    global video_cache
+    # The weights version is part of the keys: a reload never serves the verdicts of the former weights.
+    video_cache = ResultCache(version=model_registry.get_version)
+    return video_cache
+
+def get_video_cache():
+    return video_cache if video_cache is not None else init_video_cache()
+
+def submit_video_job(video_id: str):
+    try:
+        job = video_jobs.submit(detect_video_by_id, video_id, key=video_id)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"任務佇列已滿，請稍後再試: {str(e)}")
+    logging.info(f"視頻任務已建立: {job.job_id}，視頻ID: {video_id}")
+    return job.to_dict()
+
+def get_video_cache_stats():
+    return get_video_cache().get_stats()
+
+def get_video_job(job_id: str):
+    job = video_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"找不到任務: {job_id}")
+    return job.to_dict()
+
+def detect_video_by_id(video_id: str, progress=None):
+    """
+    Download the video of the tweet and classify it. Blocking, runs in the job pool and waits for a free slot of
+    the I/O / inference executors.
+    :param progress: Optional callback progress(stage, fraction)
+    """
+    progress = progress or (lambda stage, fraction: None)
+    logging.debug(f"開始處理視頻ID: {video_id}")
+    twitter_url = f"https://twitter.com/i/status/{video_id}"
+    logging.info(f"構建的Twitter URL: {twitter_url}")
+
+    video_cache = get_video_cache()
+    result = video_cache.get_tweet(video_id)
+    if result is not None:
+        logging.info(f"命中推文快取: {video_id}")
+        return result
+
+    progress("downloading", 0.0)
+    file_path = io_executor.call(download_twitter_video, twitter_url)
+    logging.info(f"視頻下載完成，文件路徑: {file_path}")
+
     try:
-        logging.debug(f"開始處理視頻ID: {video_id}")
-        twitter_url = f"https://twitter.com/i/status/{video_id}"
-        logging.info(f"構建的Twitter URL: {twitter_url}")
-        
-        file_path = download_twitter_video(twitter_url)
-        logging.info(f"視頻下載完成，文件路徑: {file_path}")
-        
-        block_size = 16
-        logging.debug(f"開始分類視頻，使用的塊大小: {block_size}")
-        result = classify_video(file_path, block_size)
-        logging.info("視頻分類完成")
-        
+        digest = file_sha256(file_path)
+        result = video_cache.get_video(digest)
+        if result is None:
+            block_size = 16
+            logging.debug(f"開始分類視頻，使用的塊大小: {block_size}")
+            progress("detecting", 0.2)
+            result = inference_executor.call(classify_video, file_path, block_size, digest)
+            logging.info("視頻分類完成")
+            video_cache.set_video(digest, result)
+        else:
+            logging.info(f"命中視頻內容快取: {digest}")
+        video_cache.set_tweet(video_id, result)
+    finally:
         os.remove(file_path)
         logging.debug(f"臨時文件已刪除: {file_path}")
-        
-        return result
-    except Exception as e:
-        logging.exception(f"處理視頻時發生錯誤: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"處理視頻時發生錯誤: {str(e)}")
+
+    return result
+
+def submit_reclassify_job():
+    try:
+        job = video_jobs.submit(reclassify_stored_videos, key="reclassify")
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"任務佇列已滿，請稍後再試: {str(e)}")
+    logging.info(f"重新分類任務已建立: {job.job_id}")
+    return job.to_dict()
+
+def reclassify_stored_videos(progress=None):
+    """
+    Re-score the videos of the landmark store with the current weights (e.g. after a reload) without downloading
+    or tracking them again, and write the new results to the video hash level of the cache. The tweet level does
+    not record the video hash: it is cleared if any result changed.
+    :param progress: Optional callback progress(stage, fraction)
+    :return: {"videos": number of re-scored videos, "changed": number of changed results}
+    """
+    progress = progress or (lambda stage, fraction: None)
+    video_cache = get_video_cache()
+    video_hashes = landmark_store.list_hashes()
+    block_size = 16
+    videos, changed = 0, 0
+    for i, video_hash in enumerate(video_hashes):
+        progress("reclassifying", i / len(video_hashes))
+        # One task per video, so the requests of the users are not queued behind the whole store.
+        result = inference_executor.call(reclassify_stored, block_size, [video_hash]).get(video_hash)
+        if result is None:
+            continue
+        videos += 1
+        former = video_cache.get_video(video_hash)
+        if former is not None:
+            result["video"] = former["video"]  # The file name of the download, the store only knows the hash.
+        if result != former:
+            changed += 1
+            video_cache.set_video(video_hash, result)
+    if changed:
+        video_cache.clear_tweets()
+    logging.info(f"重新分類完成: {videos} 個視頻，{changed} 個結果已更新")
+    return {"videos": videos, "changed": changed}
 
 def download_twitter_video(url: str) -> str:
     logging.debug(f"開始下載Twitter視頻: {url}")
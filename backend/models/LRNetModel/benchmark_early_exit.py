@@ -0,0 +1,78 @@
+import sys
+import time
+import pathlib
+import argparse
+import logging
+
+# 添加项目根目录到 Python 路径
+project_root = pathlib.Path(__file__).parent.parent.parent.as_posix()
+sys.path.append(project_root)
+
+from models.LRNetModel.utils import shared
+from models.LRNetModel import classify_pipeline
+
+"""
+Latency saved versus accuracy lost by the early-exit classification (LRNET_EARLY_EXIT), on a labelled set:
+    python models/LRNetModel/benchmark_early_exit.py <dataset>
+    - <dataset>/real/* and <dataset>/fake/*: the videos, labelled by their folder.
+    - Each video is classified with the full decode window, then with the early exit (the landmark store is not used,
+    so both modes track the faces).
+"""
+
+VIDEO_SUFFIXES = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+
+
+def list_videos(dataset):
+    """
+    :return: list of (video path, label)
+    """
+    videos = []
+    for label in ['Real', 'Fake']:
+        folder = pathlib.Path(dataset) / label.lower()
+        videos += [(path.as_posix(), label) for path in sorted(folder.iterdir()) if path.suffix.lower() in VIDEO_SUFFIXES]
+    return videos
+
+
+def run(video_path, block, early_exit):
+    shared.early_exit = early_exit
+    start = time.perf_counter()
+    result = classify_pipeline.classify_video(video_path, block)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the early-exit classification on a labelled set")
+    parser.add_argument('dataset', help="Folder with the 'real' and 'fake' sub-folders")
+    parser.add_argument('--block', type=int, default=16)
+    args = parser.parse_args()
+
+    videos = list_videos(args.dataset)
+    if len(videos) == 0:
+        print(f"No video in {args.dataset}/real or {args.dataset}/fake")
+        sys.exit(1)
+    run(videos[0][0], args.block, False)  # Warm up the models and the detectors.
+
+    totals = {mode: {'seconds': 0.0, 'frames': 0, 'correct': 0} for mode in ['full', 'early']}
+    agree = 0
+    for video_path, label in videos:
+        full, full_seconds = run(video_path, args.block, False)
+        early, early_seconds = run(video_path, args.block, True)
+        for mode, result, seconds in [('full', full, full_seconds), ('early', early, early_seconds)]:
+            totals[mode]['seconds'] += seconds
+            totals[mode]['correct'] += result['label'] == label
+        totals['early']['frames'] += early['frames']
+        agree += full['label'] == early['label']
+        print(f"{label:4s} full {full['label']:7s} {full_seconds:6.2f}s  early {early['label']:7s} "
+              f"{early_seconds:6.2f}s {early['frames']:4d} frames  {video_path}")
+
+    n = len(videos)
+    print(f"videos: {n}, same label: {agree / n:.1%}")
+    for mode, total in totals.items():
+        print(f"{mode:5s} accuracy {total['correct'] / n:.1%}  latency {total['seconds'] / n:6.2f}s/video")
+    print(f"early frames {totals['early']['frames'] / n:.1f}/video, "
+          f"latency saved {1 - totals['early']['seconds'] / totals['full']['seconds']:.1%}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
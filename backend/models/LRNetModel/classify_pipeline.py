@@ -2,10 +2,10 @@ import pathlib
 import os
 import sys
 import numpy as np
-import cv2
-import torch
+from numpy.lib.stride_tricks import sliding_window_view
 from tqdm import tqdm
 from collections import Counter
+from itertools import islice
 import logging
 
 # 設置日誌級別
@@ -16,74 +16,221 @@ project_root = pathlib.Path(__file__).parent.parent.parent.parent.as_posix()
 sys.path.append(project_root)
 
 from models.LRNetModel.utils import shared
-from models.LRNetModel.utils.landmark_utils import detect_frames_track
-from models.LRNetModel.utils.model import LRNet
+from models.LRNetModel.utils.landmark_utils import detect_video_track
+from models.LRNetModel import landmark_store
+from models.LRNetModel.frame_source import get_frame_source
+from models.LRNetModel.inference_batcher import get_batcher
 
-def detect_track(video_path, max_frames=100):
-    logging.info(f"開始處理視頻：{video_path}")
-    vidcap = cv2.VideoCapture(video_path)
-    fps = vidcap.get(cv2.CAP_PROP_FPS)
-    logging.debug(f"視頻FPS：{fps}")
-    frames = []
+def read_frames(video_path, max_frames=100):
+    """
+    Decode the frames one by one, so the whole clip is never materialized in memory.
+    The decoder is selected by `shared.frame_source` (see `frame_source.py`).
+    """
     frame_count = 0
+    try:
+        for image in get_frame_source(video_path).read(max_frames):
+            frame_count += 1
+            if frame_count % 10 == 0:
+                logging.debug(f"已讀取 {frame_count} 幀")
+            yield image
+    finally:
+        logging.debug(f"總共讀取到 {frame_count} 幀")
 
-    while frame_count < max_frames:
-        success, image = vidcap.read()
-        if not success:
-            break
-        frames.append(image)
-        frame_count += 1
-        if frame_count % 10 == 0:
-            logging.debug(f"已讀取 {frame_count} 幀")
+def read_burst(video_path, start_msec, burst_frames):
+    """
+    Decode `burst_frames` consecutive frames from `start_msec`, seeking to it instead of decoding the frames before.
+    """
+    return get_frame_source(video_path).read(burst_frames, start_msec)
 
-    logging.info(f"總共讀取到 {frame_count} 幀")
+def burst_starts(frame_count, fps, burst_frames, num_bursts):
+    """
+    Start timestamps (ms) of `num_bursts` bursts evenly spaced over the whole video.
+    """
+    last_start = max(frame_count - burst_frames - 1, 0) / fps * 1000  # Keep a frame of margin before the end.
+    return np.linspace(0, last_start, num_bursts).tolist()
 
-    raw_data = detect_frames_track(frames, os.path.basename(video_path), fps)
-    vidcap.release()
-    
-    if isinstance(raw_data, list):
-        raw_data = np.array(raw_data)
+def burst_plan(fps, frame_count, max_frames, block):
+    """
+    :return: The start timestamps (ms) of the bursts of `block` frames if the video is sampled in bursts, otherwise
+    None (the first `max_frames` frames are used).
+    """
+    num_bursts = max_frames // block
+    if shared.frame_sampling == 'bursts' and fps > 0 and frame_count > max_frames and num_bursts > 1:
+        return burst_starts(frame_count, fps, block, num_bursts)
+    return None
+
+def detect_track(video_path, max_frames=100, stats=None, block=16):
+    """
+    :param max_frames: Decode budget of the video (Int)
+    :param block: Block size of LRNet, which is also the length of the bursts in the 'bursts' sampling (Int)
+    :param stats: Optional dict, filled with the fps, frame count, average landmark score, the sampling and
+                  the length of each independently tracked segment of the landmarks
+    """
+    logging.info(f"開始處理視頻：{video_path}")
+    fps, frame_count = get_frame_source(video_path).probe()
+    logging.debug(f"視頻FPS：{fps}，總幀數：{frame_count}")
+    if stats is None:
+        stats = {}
+    stats["fps"] = fps
+
+    starts = burst_plan(fps, frame_count, max_frames, block)
+    if starts is not None:
+        raw_data = detect_track_bursts(video_path, fps, starts, block, stats)
+    else:
+        stats["sampling"] = "head"
+        raw_data = detect_video_track(lambda: read_frames(video_path, max_frames), os.path.basename(video_path), fps,
+                                      stats=stats)
+        stats["segments"] = [len(raw_data)]
     
     if raw_data.size == 0:
         logging.warning("raw_data 為空")
-        return np.array([])
     
     logging.debug(f"原始數據形狀：{raw_data.shape}")
     return raw_data
 
-def get_data_from_video(video_path, block):
+def detect_track_bursts(video_path, fps, starts, burst_frames, stats):
+    """
+    Track the face in short bursts of frames spread over the whole video, instead of in its first frames only.
+        - Each burst is tracked independently (the tracker assumes consecutive frames), so the bursts are kept as
+        separate segments, and a block never spans two bursts.
+    :param starts: Start timestamp (ms) of each burst
+    """
+    logging.info(f"分段取樣：{len(starts)} 段，每段 {burst_frames} 幀")
+    tracked = []
+    for start_msec in starts:
+        burst_stats = {}
+        landmarks = detect_video_track(lambda: read_burst(video_path, start_msec, burst_frames),
+                                       os.path.basename(video_path), fps, stats=burst_stats)
+        tracked.append((landmarks, burst_stats))
+    stats["sampling"] = "bursts"
+    return merge_tracked_segments(tracked, stats)
+
+def merge_tracked_segments(tracked, stats):
+    """
+    Concatenate independently tracked segments, recording their lengths, frame count and average landmark score
+    in `stats`.
+    :param tracked: list of (landmarks, stats of `detect_video_track`) of each segment
+    """
+    segments = [landmarks for landmarks, _ in tracked if len(landmarks) != 0]
+    frames = sum(segment_stats.get('frames', 0) for _, segment_stats in tracked)
+    scores = sum(segment_stats.get('avg_score', 0) * segment_stats.get('frames', 0) for _, segment_stats in tracked)
+    stats["segments"] = [len(landmarks) for landmarks in segments]
+    stats["frames"] = frames
+    stats["avg_score"] = float(scores / frames) if frames else 0.0
+    if len(segments) == 0:
+        return np.empty((0, 136), dtype=np.float32)
+    return np.concatenate(segments)
+
+def track_segments(video_path, max_frames=100, block=16, chunk=None):
+    """
+    Track the decode window segment by segment, for the early-exit classification: each burst with the 'bursts'
+    sampling, otherwise consecutive chunks of `chunk` frames. Each segment is tracked independently.
+        - A chunk whose first frames have no face loses them (see `detect_video_track`), and may be left without a
+        full block: use a larger chunk if the faces are often missed.
+    :param chunk: Frames per chunk, default to `tracking_chunk(block)` (Int)
+    :return: generator of (landmarks, stats of `detect_video_track`) of each segment. The stats also record the
+    sampling, and the chunk size of the chunks (which are not tracked as the whole window would be).
+    """
+    fps, frame_count = get_frame_source(video_path).probe()
+    video = os.path.basename(video_path)
+    starts = burst_plan(fps, frame_count, max_frames, block)
+    if starts is not None:
+        for start_msec in starts:
+            stats = {"fps": fps, "sampling": "bursts"}
+            landmarks = detect_video_track(lambda: read_burst(video_path, start_msec, block), video, fps, stats=stats)
+            yield landmarks, stats
+        return
+
+    chunk = tracking_chunk(block, chunk)
+    frames_iter = read_frames(video_path, max_frames)
+    while True:
+        # A chunk is small enough to be kept for the two passes of the tracker.
+        frames = list(islice(frames_iter, chunk))
+        if len(frames) < block:  # Too short for a block, tracking it would not change the verdict.
+            return
+        stats = {"fps": fps, "sampling": "head", "chunk": chunk}
+        landmarks = detect_video_track(lambda: iter(frames), video, fps, stats=stats)
+        yield landmarks, stats
+
+def tracking_chunk(block, chunk=None):
+    """
+    Frames per chunk of the early-exit tracking with the 'head' sampling: `chunk`, or `shared.early_exit_chunk`,
+    or `block` if 0.
+    """
+    return chunk or shared.early_exit_chunk or block
+
+def load_or_detect_track(video_path, video_hash=None, block=16):
+    """
+    The tracked landmarks of the video. Read from the landmark store if this video (same hash) was already tracked
+    with the same frame sampling, otherwise track it and store the result.
+    :return: raw_data, segments (the length of each independently tracked segment, None for a single one)
+    """
+    raw_data, meta = load_stored_track(video_hash)
+    if raw_data is not None:
+        return raw_data, meta.get('segments')
+
+    stats = {}
+    raw_data = detect_track(video_path, stats=stats, block=block)
+    if video_hash is not None:
+        landmark_store.save_landmarks(video_hash, raw_data, stats)
+    return raw_data, stats.get('segments')
+
+def load_stored_track(video_hash, chunk=None):
+    """
+    :param chunk: Also accept the landmarks tracked in chunks of `chunk` frames by the early exit (see
+    `track_segments`). Each chunk restarts the tracker, so these landmarks differ from the ones of the whole window.
+    :return: (raw_data, meta) from the landmark store if the video was tracked with the current frame sampling (and
+    as a whole, or in chunks of `chunk` frames), otherwise (None, None)
+    """
+    if video_hash is None:
+        return None, None
+    raw_data, meta = landmark_store.load_landmarks(video_hash)
+    if raw_data is None or meta.get('sampling', 'head') != shared.frame_sampling:
+        return None, None
+    if meta.get('chunk') not in (None, chunk):
+        return None, None
+    logging.info(f"命中特徵點快取：{video_hash}，幀數：{meta['frames']}")
+    return raw_data, meta
+
+def get_data_from_video(video_path, block, video_hash=None):
     logging.info("開始提取特徵點並加載數據...")
     video_name = os.path.basename(video_path).split('.')[0]
     logging.info(f"正在處理視頻：{video_name}")
 
-    raw_data = detect_track(video_path)
+    raw_data, segments = load_or_detect_track(video_path, video_hash, block)
+    return get_data_from_landmarks(raw_data, block, video_name, segments)
 
+def get_data_from_landmarks(raw_data, block, video_name, segments=None, stride=None):
+    """
+    Cut the landmark sequence into blocks with a sliding window: every full window of `block` frames, every
+    `stride` frames (the last full block included).
+    :param segments: The length of each independently tracked segment of `raw_data`, blocks never span two of them.
+    :param stride: Frames between the starts of two blocks, default to `shared.block_stride`, or `block` if 0 (Int)
+        - The windows are views of the landmarks, so overlapping blocks (stride < block) only cost the final copy.
+    :return: x (the landmark blocks, contiguous float32) [Shape: (B, block, 136)], sample_to_video.
+        The frame differences for g2 are computed by the ensemble.
+    """
     if len(raw_data) == 0:
         logging.warning(f"在 {video_name} 中未檢測到人臉")
-        return np.array([]), np.array([]), np.array([])
-
-    x, x_diff, sample_to_video = [], [], []
-    for i in range(0, raw_data.shape[0] - block, block):
-        vec = raw_data[i:i + block, :]
-        x.append(vec)
-        vec_next = raw_data[i + 1:i + block, :]
-        vec_next = np.pad(vec_next, ((0, 1), (0, 0)), 'constant', constant_values=(0, 0))
-        vec_diff = (vec_next - vec)[:block - 1, :]
-        x_diff.append(vec_diff)
-        sample_to_video.append(video_name)
-
-    logging.debug(f"處理後的數據形狀：x={len(x)}, x_diff={len(x_diff)}, sample_to_video={len(sample_to_video)}")
-    return np.array(x), np.array(x_diff), np.array(sample_to_video)
-
-def predict(model, sample, device):
-    logging.debug(f"開始預測，使用設備：{device}")
-    model.to(device)
-    model.eval()
-    sample = torch.from_numpy(sample).float().to(device)
-    output = model(sample)
-    predictions = output.cpu().detach().numpy()
-    logging.debug(f"預測結果形狀：{predictions.shape}")
-    return predictions
+        return np.array([]), np.array([])
+
+    stride = stride or shared.block_stride or block
+    windows = []
+    offset = 0
+    for length in segments or [raw_data.shape[0]]:
+        segment = raw_data[offset:offset + length]
+        offset += length
+        if length >= block:
+            # [Shape: (length - block + 1, 136, block)] -> (B, block, 136)
+            windows.append(sliding_window_view(segment, block, axis=0)[::stride].transpose(0, 2, 1))
+    if len(windows) == 0:
+        logging.warning(f"{video_name} 的幀數不足一個區塊")
+        return np.array([]), np.array([])
+
+    x = np.concatenate(windows)  # The only copy, contiguous.
+    sample_to_video = np.array([video_name] * len(x))
+    logging.debug(f"處理後的數據形狀：x={x.shape}, sample_to_video={len(sample_to_video)}")
+    return x, sample_to_video
 
 def merge_video_prediction(mix_prediction, s2v, vc):
     logging.info("開始合併視頻預測結果")
@@ -100,41 +247,117 @@ def merge_video_prediction(mix_prediction, s2v, vc):
     logging.debug(f"合併後的預測結果：{prediction_video}")
     return prediction_video
 
-def classify_video(video_path, block_size):
+def classify_video(video_path, block_size, video_hash=None):
+    """
+    :param video_hash: SHA-256 of the video. If given, the tracked landmarks are read from / written to the
+    landmark store, so re-classifying the same video only reruns LRNet.
+    """
+    if shared.early_exit:
+        return classify_video_early_exit(video_path, block_size, video_hash)
     logging.info(f"開始分類視頻：{video_path}")
-    test_samples, test_samples_diff, test_sv = get_data_from_video(video_path, block_size)
+    test_samples, test_sv = get_data_from_video(video_path, block_size, video_hash)
+    return classify_samples(test_samples, test_sv, os.path.basename(video_path))
 
-    if len(test_samples) == 0:
-        logging.warning("沒有檢測到有效樣本")
-        return {"video": os.path.basename(video_path), "label": "Unknown", "score": 0}
+def sequential_verdict(scores, vote_accuracy=None, alpha=None):
+    """
+    Wald's sequential probability ratio test on the block votes (score >= 0.5), between "fake" (each vote is fake
+    with probability `vote_accuracy`) and "real" (each vote is fake with probability 1 - `vote_accuracy`).
+    :param vote_accuracy: Default to `shared.early_exit_vote_accuracy` (float)
+    :param alpha: Accepted error rate of both verdicts, default to `shared.early_exit_alpha` (float)
+    :return: "Fake", "Real", or None while the votes are not decisive
+    """
+    vote_accuracy = vote_accuracy or shared.early_exit_vote_accuracy
+    alpha = alpha or shared.early_exit_alpha
+    fake_votes = int(np.count_nonzero(np.asarray(scores) >= 0.5))
+    log_likelihood_ratio = (2 * fake_votes - len(scores)) * np.log(vote_accuracy / (1 - vote_accuracy))
+    bound = np.log((1 - alpha) / alpha)
+    if log_likelihood_ratio >= bound:
+        return "Fake"
+    if log_likelihood_ratio <= -bound:
+        return "Real"
+    return None
 
-    weights_g1 = os.path.join(os.path.dirname(__file__), 'model_weights', 'g1.pth')
-    weights_g2 = os.path.join(os.path.dirname(__file__), 'model_weights', 'g2.pth')
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logging.info(f"使用設備：{device}")
+def classify_video_early_exit(video_path, block_size, video_hash=None, max_frames=100):
+    """
+    Score the blocks of each segment as soon as it is tracked (see `track_segments`), and stop decoding and
+    tracking once `sequential_verdict` is decisive.
+    :return: The result of `classify_samples`, with the number of decoded frames ("frames") and whether the
+    sequential test stopped the classification ("early_exit").
+    """
+    logging.info(f"開始分類視頻（提前結束模式）：{video_path}")
+    video_name = os.path.basename(video_path)
+    raw_data, meta = load_stored_track(video_hash, tracking_chunk(block_size))
+    if raw_data is not None:  # Already tracked, scoring all the blocks is cheap.
+        test_samples, test_sv = get_data_from_landmarks(raw_data, block_size, video_name, meta.get('segments'))
+        return dict(classify_samples(test_samples, test_sv, video_name), frames=meta['frames'], early_exit=False)
 
-    g1 = LRNet()
-    g2 = LRNet()
+    tracked, scores, verdict = [], [], None
+    for landmarks, stats in track_segments(video_path, max_frames, block_size):
+        tracked.append((landmarks, stats))
+        samples, _ = get_data_from_landmarks(landmarks, block_size, video_name)
+        if len(samples) == 0:
+            continue
+        scores.append(get_batcher().predict(samples))
+        verdict = sequential_verdict(np.concatenate(scores))
+        if verdict is not None:
+            break
+    frames = sum(stats.get('frames', 0) for _, stats in tracked)
+    logging.info(f"已使用 {frames} 幀，{sum(len(s) for s in scores)} 個區塊，序貫檢定結果：{verdict or '未決'}")
 
-    logging.info("正在加載模型並進行預測...")
+    if verdict is None and video_hash is not None and len(tracked) != 0:
+        # The whole window was tracked: store it, with the chunk size if it was tracked in chunks (only read by the
+        # early exit with the same chunk size then).
+        first = tracked[0][1]
+        stats = {"fps": first["fps"], "sampling": first["sampling"]}
+        if "chunk" in first:
+            stats["chunk"] = first["chunk"]
+        landmark_store.save_landmarks(video_hash, merge_tracked_segments(tracked, stats), stats)
 
-    g1.load_state_dict(torch.load(weights_g1, map_location=device))
-    g2.load_state_dict(torch.load(weights_g2, map_location=device))
+    if len(scores) == 0:
+        logging.warning("沒有檢測到有效樣本")
+        return {"video": video_name, "label": "Unknown", "score": 0, "frames": frames, "early_exit": False}
+    mix_predict = np.concatenate(scores)
+    result = video_result(mix_predict, [video_name] * len(mix_predict), video_name)
+    return dict(result, frames=frames, early_exit=verdict is not None)
+
+def reclassify_stored(block_size, video_hashes=None):
+    """
+    Re-score the videos in the landmark store with the current models, without tracking the faces again.
+        - Only the landmarks the current settings would read (see `load_stored_track`) are re-scored.
+    :return: {video_hash: result}
+    """
+    chunk = tracking_chunk(block_size) if shared.early_exit else None
+    results = {}
+    for video_hash in video_hashes or landmark_store.list_hashes():
+        raw_data, meta = load_stored_track(video_hash, chunk)
+        if raw_data is None:
+            logging.warning(f"特徵點快取中沒有以目前設定追蹤的 {video_hash}")
+            continue
+        test_samples, test_sv = get_data_from_landmarks(raw_data, block_size, video_hash, meta.get('segments'))
+        results[video_hash] = classify_samples(test_samples, test_sv, video_hash)
+    return results
+
+def classify_samples(test_samples, test_sv, video_name):
+    if len(test_samples) == 0:
+        logging.warning("沒有檢測到有效樣本")
+        return {"video": video_name, "label": "Unknown", "score": 0}
 
-    prediction = predict(g1, test_samples, device)
-    prediction_diff = predict(g2, test_samples_diff, device)
+    logging.info("正在進行預測...")
 
-    assert len(prediction) == len(prediction_diff)
-    mix_predict = []
-    for i in range(len(prediction)):
-        mix = prediction[i][1] + prediction_diff[i][1]
-        mix_predict.append(mix / 2)
+    # The g1/g2 ensemble runs on batches gathered from the concurrent requests (see `inference_batcher.py`).
+    mix_predict = get_batcher().predict(test_samples)
+    assert len(mix_predict) == len(test_samples)
+    return video_result(mix_predict, test_sv, video_name)
 
+def video_result(mix_predict, test_sv, video_name):
+    """
+    :param mix_predict: Fake score of each block [Shape: (B,)]
+    :return: {"video", "label", "score"}, the score being the fraction of the blocks voted fake
+    """
     video_count = Counter(test_sv)
 
     prediction_video = merge_video_prediction(mix_predict, test_sv, video_count)
 
-    video_name = os.path.basename(video_path)
     score = prediction_video[0] if prediction_video else 0
     label = "Fake" if score >= 0.5 else "Real"
 
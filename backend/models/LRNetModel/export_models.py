@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import pathlib
+import argparse
+import logging
+import torch
+from torch import nn
+
+# 添加项目根目录到 Python 路径
+project_root = pathlib.Path(__file__).parent.parent.parent.as_posix()
+sys.path.append(project_root)
+
+from models.LRNetModel.runtime import (EXPORT_DIR, artifact_path, fixture_inputs, load_artifact, check_parity,
+                                      weights_sha256, write_sidecar)
+
+"""
+Export the networks of the pipeline for the CPU runtimes selected in `runtime.py`, then check them against the
+eager `.pth` networks. Each artifact gets a `.json` sidecar with the SHA-256 of the weights it was exported from:
+re-export after changing the weights, the stale artifacts are not used.
+    python models/LRNetModel/export_models.py --models lrnet retinaface fan --format torchscript onnx --quantize
+    - int8 dynamic quantization: GRU/Linear of LRNet (TorchScript and ONNX).
+    - `--quantize-convs` also quantizes the convolutions of RetinaFace and the FAN (ONNX Runtime only, PyTorch has no
+    dynamic quantization of convolutions). Dynamic ConvInteger is usually slower and less accurate than fp32 on CPU,
+    so these artifacts are only kept for evaluation: check the report before enabling them.
+"""
+
+MODELS = ['lrnet', 'retinaface', 'fan']
+ONNX_IO = {
+    'lrnet': (['x'], ['score'], {'x': {0: 'batch'}, 'score': {0: 'batch'}}),
+    'retinaface': (['x'], ['loc', 'conf', 'landms'],
+                   {'x': {0: 'batch', 2: 'height', 3: 'width'},
+                    'loc': {0: 'batch', 1: 'priors'}, 'conf': {0: 'batch', 1: 'priors'},
+                    'landms': {0: 'batch', 1: 'priors'}}),
+    'fan': (['x'], ['heatmaps'], {'x': {0: 'batch'}, 'heatmaps': {0: 'batch'}}),
+}
+ONNX_QUANTIZED_OPS = {
+    'lrnet': ['MatMul', 'Gemm'],
+    'retinaface': ['Conv'],
+    'fan': ['Conv'],
+}
+
+
+class LastOutput(nn.Module):
+    """
+    Stacked hourglass FANs return the output of every stack, the pipeline only uses the last one.
+    """
+    def __init__(self, module):
+        super(LastOutput, self).__init__()
+        self.module = module
+
+    def forward(self, x):
+        return self.module(x)[-1]
+
+
+def build_eager(name):
+    """
+    :return: The eager network of `name`, loaded from its `.pth` weights on the CPU
+    """
+    if name == 'lrnet':
+        from models.LRNetModel import model_registry
+        g1, g2, _ = model_registry.load_models(device='cpu')
+        from models.LRNetModel.utils.model import LRNetEnsemble
+        return LRNetEnsemble(g1, g2).eval()
+    if name == 'retinaface':
+        from models.LRNetModel.utils.FaceDetector import functions
+        functions.args['cpu'] = True
+        return functions.get_detector()
+    if name == 'fan':
+        import face_alignment
+        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, face_detector='folder', device='cpu')
+        return fa.face_alignment_net
+    raise ValueError(f"Unknown network: {name}")
+
+
+def export_torchscript(name, module, path, quantize=False):
+    if quantize:
+        if name != 'lrnet':
+            raise ValueError("int8 convolutions are only supported by the ONNX runtime")
+        module = torch.ao.quantization.quantize_dynamic(module, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad():
+        if isinstance(module, torch.jit.ScriptModule):
+            scripted = module
+        else:
+            scripted = torch.jit.trace(module, fixture_inputs(name)[0])
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(name, module, path, quantize=False):
+    input_names, output_names, dynamic_axes = ONNX_IO[name]
+    fp32_path = path.replace('.int8', '')
+    with torch.no_grad():
+        if isinstance(module(fixture_inputs(name)[0][:1]), list):
+            module = LastOutput(module).eval()
+        torch.onnx.export(module, (fixture_inputs(name)[0],), fp32_path, input_names=input_names,
+                          output_names=output_names, dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8, op_types_to_quantize=ONNX_QUANTIZED_OPS[name])
+
+
+def latency_ms(module, name, repeat=5):
+    inputs = fixture_inputs(name)
+    with torch.no_grad():
+        for x in inputs:
+            module(x)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x in inputs:
+                module(x)
+    return (time.perf_counter() - start) / repeat / len(inputs) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the networks to TorchScript / ONNX and check their parity")
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=MODELS)
+    parser.add_argument('--format', nargs='+', choices=['torchscript', 'onnx'], default=['torchscript', 'onnx'])
+    parser.add_argument('--quantize', action='store_true', help="Also export the int8 dynamic-quantized LRNet")
+    parser.add_argument('--quantize-convs', action='store_true',
+                        help="Also export the int8 dynamic-quantized RetinaFace / FAN (ONNX only)")
+    parser.add_argument('--output', default=EXPORT_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    failed = []
+    for name in args.models:
+        module = build_eager(name)
+        source_sha256 = weights_sha256(module)
+        eager_ms = latency_ms(module, name)
+        print(f"{name:10s} torch       fp32  {eager_ms:8.2f} ms/batch")
+        for runtime in args.format:
+            quantize = args.quantize if name == 'lrnet' else args.quantize_convs and runtime == 'onnx'
+            for quantized in ([False, True] if quantize else [False]):
+                path = artifact_path(name, runtime, quantized, args.output)
+                exporter = export_torchscript if runtime == 'torchscript' else export_onnx
+                exporter(name, module, path, quantized)
+                write_sidecar(path, source_sha256)
+                candidate = load_artifact(name, runtime, quantized, args.output)
+                ok, max_diff = check_parity(name, module, candidate, quantized)
+                print(f"{name:10s} {runtime:11s} {'int8' if quantized else 'fp32'}  "
+                      f"{latency_ms(candidate, name):8.2f} ms/batch  max diff {max_diff:.2e}  "
+                      f"{'OK' if ok else 'FAILED'}  {path}")
+                if not ok:
+                    failed.append(path)
+    if failed:
+        print("Parity check failed:", *failed, sep="\n    ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
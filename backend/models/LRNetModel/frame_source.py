@@ -0,0 +1,121 @@
+import logging
+import cv2
+from models.LRNetModel.utils import shared
+
+"""
+Pluggable video decoders for the pipeline.
+    - 'opencv' (default): cv2.VideoCapture, full-resolution BGR frames, resized afterwards if asked.
+    - 'pyav': FFmpeg through PyAV, with threaded decoding; the scaling and the pixel-format conversion
+    are done by swscale while converting the decoded frame, so the full-resolution BGR frame is never materialized.
+All sources yield BGR uint8 frames [Shape: (H, W, 3)]: the face detectors and the FAN need the colors.
+"""
+
+
+def scaled_size(width, height, max_size):
+    """
+    :param max_size: Limit of the longer side, 0 / None for the native size (Int)
+    :return: (width, height) of the decoded frames, both even (required by most pixel formats)
+    """
+    if not max_size or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(int(round(width * scale / 2)) * 2, 2), max(int(round(height * scale / 2)) * 2, 2)
+
+
+class OpenCVFrameSource(object):
+    def __init__(self, video_path, max_size=None):
+        self.video_path = video_path
+        self.max_size = max_size
+
+    def probe(self):
+        """
+        :return: fps (float), frame_count (Int, 0 if unknown)
+        """
+        vidcap = cv2.VideoCapture(self.video_path)
+        try:
+            return vidcap.get(cv2.CAP_PROP_FPS), int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+        finally:
+            vidcap.release()
+
+    def read(self, max_frames, start_msec=0):
+        """
+        Decode up to `max_frames` consecutive frames from `start_msec`, seeking to it instead of decoding the
+        frames before.
+        """
+        vidcap = cv2.VideoCapture(self.video_path)
+        try:
+            if start_msec > 0:
+                vidcap.set(cv2.CAP_PROP_POS_MSEC, start_msec)
+            size = None
+            for _ in range(max_frames):
+                success, image = vidcap.read()
+                if not success:
+                    break
+                if size is None:
+                    size = scaled_size(image.shape[1], image.shape[0], self.max_size)
+                if size != (image.shape[1], image.shape[0]):
+                    image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+                yield image
+        finally:
+            vidcap.release()
+
+
+class PyAVFrameSource(object):
+    def __init__(self, video_path, max_size=None):
+        try:
+            import av
+        except ImportError:
+            raise ImportError("The 'pyav' frame source requires PyAV: pip install av")
+        self._av = av
+        self.video_path = video_path
+        self.max_size = max_size
+
+    def probe(self):
+        with self._av.open(self.video_path) as container:
+            stream = container.streams.video[0]
+            fps = float(stream.average_rate or stream.guessed_rate or 0)
+            frame_count = stream.frames
+            if frame_count == 0 and stream.duration is not None and fps > 0:
+                frame_count = int(stream.duration * stream.time_base * fps)
+            return fps, frame_count
+
+    def read(self, max_frames, start_msec=0):
+        if max_frames <= 0:
+            return
+        with self._av.open(self.video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'  # Frame + slice threading of the decoder
+            start = start_msec / 1000
+            if start > 0:
+                # Seek to the keyframe before `start`, then drop the frames before it.
+                container.seek(int(start / stream.time_base), stream=stream, backward=True)
+                start -= 0.5 / float(stream.average_rate or 1000)  # Half a frame of tolerance
+            size = scaled_size(stream.codec_context.width, stream.codec_context.height, self.max_size)
+            count = 0
+            for frame in container.decode(stream):
+                if frame.time is not None and frame.time < start:
+                    continue
+                yield frame.to_ndarray(width=size[0], height=size[1], format='bgr24',
+                                       interpolation='AREA')
+                count += 1
+                if count >= max_frames:
+                    break
+
+
+FRAME_SOURCES = {
+    'opencv': OpenCVFrameSource,
+    'pyav': PyAVFrameSource,
+}
+
+
+def get_frame_source(video_path, backend=None, max_size=None):
+    """
+    :param backend: 'opencv' or 'pyav', default to `shared.frame_source` (str)
+    :param max_size: Limit of the longer side of the decoded frames, default to `shared.decode_max_size` (Int)
+    """
+    backend = backend or shared.frame_source
+    if backend not in FRAME_SOURCES:
+        raise ValueError(f"Unknown frame source: {backend}")
+    max_size = shared.decode_max_size if max_size is None else max_size
+    logging.debug(f"解碼器：{backend}，最大邊長：{max_size or '原始'}")
+    return FRAME_SOURCES[backend](video_path, max_size)
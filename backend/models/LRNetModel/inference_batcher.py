@@ -0,0 +1,213 @@
+import os
+import atexit
+import time
+import queue
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError, current_process
+from multiprocessing.connection import Listener, Client
+import numpy as np
+import torch
+
+from models.LRNetModel import model_registry
+
+"""
+Dynamic micro-batching of the LRNet inference across concurrent requests.
+    - Each request submits its blocks and waits. A single worker thread gathers the blocks of the queued requests
+    (up to `max_batch_size` blocks, waiting at most `max_wait_ms` for more), runs the g1/g2 ensemble once on the
+    whole batch and scatters the scores back to the requests.
+    - Requests which arrive while a batch is running are queued, and go together into the next batch.
+    - With the process executor, each inference process tracks one request at a time: LRNet runs in the main process
+    only, and the inference processes send their blocks to its batcher (`serve` / `connect`), so the blocks of the
+    concurrent requests still meet in a single batcher.
+"""
+
+BATCH_MAX_SIZE = int(os.environ.get("LRNET_BATCH_MAX_SIZE", 64))  # Blocks per forward pass
+BATCH_MAX_WAIT_MS = float(os.environ.get("LRNET_BATCH_MAX_WAIT_MS", 2))
+
+
+class MicroBatcher:
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def predict(self, samples):
+        """
+        :param samples: Landmark blocks of one request [Shape: (B, block, 136)]
+        :return: Fake score of each block, the average of g1 and g2 [Shape: (B,)]
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((samples, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="lrnet-batcher", daemon=True)
+                    self._worker.start()
+
+    def shutdown(self):
+        """
+        Stop the worker thread once the queued requests are served.
+        """
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        if items[0] is None:
+            return None
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while size < self.max_batch_size:
+            try:
+                # With `max_wait_ms` 0, only the requests already queued are taken.
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:  # Serve the collected requests first, then stop.
+                self._queue.put(None)
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            # Requests of another block size can not be stacked together.
+            groups = defaultdict(list)
+            for item in items:
+                groups[item[0].shape[1:]].append(item)
+            for group in groups.values():
+                try:
+                    self._predict_group(group)
+                except Exception as e:
+                    logging.exception(f"批次推論失敗：{str(e)}")
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+
+    @staticmethod
+    def _predict_group(group):
+        ensemble, device = model_registry.get_ensemble()
+        # A single request is fed as is (already contiguous float32), without another copy.
+        samples = group[0][0] if len(group) == 1 else np.concatenate([item[0] for item in group])
+        samples = torch.from_numpy(samples).to(device)
+        with torch.no_grad():
+            scores = ensemble(samples).cpu().numpy()
+        logging.debug(f"批次推論：{len(group)} 個請求，{len(samples)} 個區塊")
+
+        offset = 0
+        for item_samples, future in group:
+            end = offset + len(item_samples)
+            future.set_result(scores[offset:end])
+            offset = end
+
+
+class BatcherClient:
+    """
+    The batcher of another process (see `serve`), with the `predict` of `MicroBatcher`.
+    """
+    def __init__(self, address):
+        self._conn = Client(address, authkey=current_process().authkey)
+        self._lock = threading.Lock()
+
+    def predict(self, samples):
+        with self._lock:
+            self._conn.send(samples)
+            scores, error = self._conn.recv()
+        if error is not None:
+            raise error
+        return scores
+
+
+def _serve_connection(conn, batcher):
+    # One thread per inference process: the threads wait in `predict` together, so their blocks are batched.
+    with conn:
+        while True:
+            try:
+                samples = conn.recv()
+            except (EOFError, OSError):  # The inference process has exited.
+                return
+            try:
+                reply = (batcher.predict(samples), None)
+            except Exception as e:
+                reply = (None, e)
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def _accept(listener, batcher):
+    while True:
+        try:
+            conn = listener.accept()
+        except AuthenticationError:
+            logging.warning("拒絕未經驗證的批次推論連線")
+            continue
+        except OSError:  # Closed at exit.
+            return
+        threading.Thread(target=_serve_connection, args=(conn, batcher), name="lrnet-batcher-connection",
+                         daemon=True).start()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+_server = None
+_server_lock = threading.Lock()
+_client = None
+
+
+def serve():
+    """
+    Accept the inference processes (see `connect`) on the batcher of this process, started once.
+    Spawned processes inherit the authentication key of this one, other processes are rejected.
+    :return: The address of the batcher (str)
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = Listener(authkey=current_process().authkey)
+            atexit.register(_server.close)
+            threading.Thread(target=_accept, args=(_server, get_batcher()), name="lrnet-batcher-server",
+                             daemon=True).start()
+            logging.info(f"批次推論服務已啟動：{_server.address}")
+    return _server.address
+
+
+def connect(address):
+    """
+    Send the blocks of this process to the batcher served at `address`, instead of running LRNet here.
+    """
+    global _client
+    _client = BatcherClient(address)
+
+
+def get_batcher():
+    """
+    :return: The batcher `connect`-ed to, otherwise the process-wide micro-batcher, created on first use.
+    """
+    global _batcher
+    if _client is not None:
+        return _client
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher()
+                # The worker thread must be stopped before the interpreter tears torch down.
+                atexit.register(_batcher.shutdown)
+    return _batcher
@@ -0,0 +1,88 @@
+import os
+import json
+import logging
+import tempfile
+import numpy as np
+
+"""
+On-disk store of the calibrated normalized landmark sequences, keyed by the SHA-256 of the video.
+    - <hash>.npy: float32 array [Shape: (N, 136)], loaded memory-mapped.
+    - <hash>.json: metadata (frame count, fps, average landmark score).
+Face tracking is the expensive part of the pipeline; with the landmarks stored, re-classifying a video
+(new weights, another block size or threshold) only reruns LRNet.
+"""
+
+LANDMARK_STORE_DIR = os.environ.get("LANDMARK_STORE_DIR", os.path.join(os.getcwd(), "cache", "landmarks"))
+
+
+def _paths(video_hash, store_dir):
+    return os.path.join(store_dir, video_hash + '.npy'), os.path.join(store_dir, video_hash + '.json')
+
+
+def _write_replace(path, store_dir, write):
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_landmarks(video_hash, landmarks, meta, store_dir=LANDMARK_STORE_DIR):
+    """
+    :param video_hash: SHA-256 of the video (str)
+    :param landmarks: calibrated_normalized_landmarks [Shape: (N, 136)]
+    :param meta: {"frames": Int, "fps": float, "avg_score": float}
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    npy_path, meta_path = _paths(video_hash, store_dir)
+    landmarks = np.ascontiguousarray(landmarks, dtype=np.float32)
+    meta = dict(meta, shape=list(landmarks.shape))
+    # Write to unique temporary files first: a concurrent reader never sees a partial entry, and two processes
+    # storing the same video (the same clip under two tweet ids) never replace each other's temporary file.
+    # The .json is published last, `load_landmarks` only considers an entry once its .json exists.
+    _write_replace(npy_path, store_dir, lambda file: np.save(file, landmarks))
+    _write_replace(meta_path, store_dir, lambda file: file.write(json.dumps(meta).encode('utf-8')))
+    logging.debug(f"已保存特徵點序列：{video_hash}，形狀：{landmarks.shape}")
+
+
+def _memmap_npy(path):
+    # Same as `np.load(path, mmap_mode='r')`, which reopens the file by name after reading the header: the header
+    # and the mapping then may come from two different saves. Read both from a single file handle instead.
+    with open(path, 'rb') as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        order = 'F' if fortran_order else 'C'
+        return np.memmap(file, dtype=dtype, mode='r', shape=shape, order=order, offset=file.tell())
+
+
+def load_landmarks(video_hash, store_dir=LANDMARK_STORE_DIR):
+    """
+    :return: (landmarks, meta), or (None, None) if the video is not in the store.
+    """
+    npy_path, meta_path = _paths(video_hash, store_dir)
+    if not (os.path.isfile(npy_path) and os.path.isfile(meta_path)):
+        return None, None
+    with open(meta_path, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    if 0 in meta['shape']:  # No face was detected, an empty file can not be memory-mapped.
+        return np.zeros(meta['shape'], dtype=np.float32), meta
+    landmarks = _memmap_npy(npy_path)
+    # The two replaces of `save_landmarks` are not atomic as a pair: the .npy may belong to another save of
+    # the same video than the .json (e.g. another frame sampling). Treat the entry as missing then.
+    if list(landmarks.shape) != list(meta['shape']):
+        logging.warning(f"特徵點序列與其資訊不一致，忽略：{video_hash}")
+        return None, None
+    return landmarks, meta
+
+
+def list_hashes(store_dir=LANDMARK_STORE_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(store_dir) if name.endswith('.json'))
@@ -0,0 +1,139 @@
+import os
+import hashlib
+import threading
+import logging
+import torch
+
+from models.LRNetModel.utils.model import LRNet, LRNetEnsemble
+from models.LRNetModel.runtime import select_module
+
+"""
+Process-wide registry of the LRNet classifiers.
+    - g1 (raw landmark blocks) and g2 (landmark diff blocks) are deserialized once at startup,
+    pinned to the selected device in eval mode and then shared by all requests.
+    - The requests run them fused as one `LRNetEnsemble`, published together with them. It is replaced by its
+    TorchScript / ONNX artifact when one is selected (see `runtime.py`).
+    - `reload_models` swaps the weights atomically, so in-flight requests keep the networks they started with.
+"""
+
+WEIGHTS_DIR = os.path.join(os.path.dirname(__file__), 'model_weights')
+DEFAULT_WEIGHTS_G1 = os.path.join(WEIGHTS_DIR, 'g1.pth')
+DEFAULT_WEIGHTS_G2 = os.path.join(WEIGHTS_DIR, 'g2.pth')
+
+_lock = threading.Lock()
+_models = None  # (g1, g2, device)
+_ensemble = None  # (LRNetEnsemble(g1, g2), device)
+_weights = {'g1': DEFAULT_WEIGHTS_G1, 'g2': DEFAULT_WEIGHTS_G2}
+_digests = {}  # (path, mtime) -> SHA-256 of the weights file
+
+
+def _select_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _build_model(weights_path, device):
+    model = LRNet()
+    model.load_state_dict(torch.load(weights_path, map_location=device))
+    model.to(device)
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad_(False)
+    return model
+
+
+def load_models(weights_g1=None, weights_g2=None, device=None):
+    """
+    Load g1/g2 and publish them to the registry.
+    :param weights_g1: Path of the g1 weights, keep the current one if None (str)
+    :param weights_g2: Path of the g2 weights, keep the current one if None (str)
+    :param device: 'cpu' or 'cuda', auto-selected if None (str)
+    :return: (g1, g2, device)
+    """
+    global _models, _ensemble
+    device = device or _select_device()
+    weights_g1 = weights_g1 or _weights['g1']
+    weights_g2 = weights_g2 or _weights['g2']
+    logging.info(f"加載模型權重：{weights_g1}, {weights_g2}，設備：{device}")
+
+    # Build outside the lock, so the old networks keep serving while the new ones are loading.
+    g1 = _build_model(weights_g1, device)
+    g2 = _build_model(weights_g2, device)
+    ensemble = select_module('lrnet', LRNetEnsemble(g1, g2).eval())
+
+    with _lock:
+        _models = (g1, g2, device)
+        _ensemble = (ensemble, device)
+        _weights['g1'] = weights_g1
+        _weights['g2'] = weights_g2
+    return _models
+
+
+def resolve_weights(name):
+    """
+    Map a weights file name to a path inside `model_weights/`, so the reload endpoint can not load arbitrary files.
+    """
+    if name is None:
+        return None
+    path = os.path.join(WEIGHTS_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return path
+
+
+def reload_models(weights_g1=None, weights_g2=None):
+    """
+    Hot-swap the weights. The device of the current models is kept.
+    :param weights_g1: File name of the new g1 weights under `model_weights/` (str)
+    :param weights_g2: File name of the new g2 weights under `model_weights/` (str)
+    """
+    device = _models[2] if _models is not None else None
+    return load_models(resolve_weights(weights_g1), resolve_weights(weights_g2), device)
+
+
+def get_ensemble():
+    """
+    :return: (ensemble, device). Lazily load it if the startup hook has not run (e.g. CLI usage).
+    """
+    ensemble = _ensemble
+    if ensemble is None:
+        load_models()
+        ensemble = _ensemble
+    return ensemble
+
+
+def weights_sha256(path):
+    """
+    :return: SHA-256 of a weights file, computed once per modification of the file
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    digest = _digests.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for data in iter(lambda: file.read(1 << 20), b''):
+                sha256.update(data)
+        digest = _digests[key] = sha256.hexdigest()
+    return digest
+
+
+def get_version():
+    """
+    :return: Version of the selected g1/g2 weights, derived from their content (str)
+    """
+    weights = dict(_weights)
+    return hashlib.sha256((weights_sha256(weights['g1']) + weights_sha256(weights['g2'])).encode()).hexdigest()[:16]
+
+
+def get_status():
+    """
+    :return: The state of the LRNet classifiers of this process, which serve all the requests: with the process
+    executor, the inference processes only track the faces and send their blocks here (see `inference_batcher.py`).
+    """
+    models = _models
+    return {
+        "loaded": models is not None,
+        "device": models[2] if models is not None else None,
+        "weights_g1": _weights['g1'],
+        "weights_g2": _weights['g2'],
+        "version": get_version(),
+    }
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import torch
+
+"""
+Runtime selection of the networks: eager PyTorch with the `.pth` weights (default), or the optimized artifacts
+written by `export_models.py` (TorchScript, ONNX Runtime, optionally int8-quantized).
+    - An artifact is only used if it was exported from the same weights as the eager network (SHA-256 recorded in
+    its `.json` sidecar), and after an accuracy-parity check against the eager network on a fixed fixture set.
+    When it is missing, stale or fails the check, the eager network keeps serving.
+    - LRNET_RUNTIME: 'torch', 'torchscript' or 'onnx'.
+    - LRNET_QUANTIZED: use the int8 artifacts.
+"""
+
+EXPORT_DIR = os.environ.get("LRNET_EXPORT_DIR", os.path.join(os.path.dirname(__file__), 'exported'))
+RUNTIME = os.environ.get("LRNET_RUNTIME", "torch")
+QUANTIZED = os.environ.get("LRNET_QUANTIZED", "0") == "1"
+
+# Max absolute difference of the outputs to the eager network, (fp32, int8).
+PARITY_TOLERANCE = {
+    'lrnet': (1e-4, 0.05),
+    'retinaface': (1e-3, 0.1),
+    'fan': (1e-3, 0.1),
+}
+
+
+def artifact_path(name, runtime, quantized=False, export_dir=EXPORT_DIR):
+    """
+    :param name: 'lrnet', 'retinaface' or 'fan' (str)
+    :param runtime: 'torchscript' or 'onnx' (str)
+    """
+    suffix = '.pt' if runtime == 'torchscript' else '.onnx'
+    return os.path.join(export_dir, name + ('.int8' if quantized else '') + suffix)
+
+
+def weights_sha256(module):
+    """
+    :return: SHA-256 of the weights of a network (its state dict), to tie an artifact to the weights it was
+    exported from (str)
+    """
+    digest = hashlib.sha256()
+    for key, tensor in module.state_dict().items():
+        digest.update(key.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def write_sidecar(path, source_sha256):
+    with open(path + '.json', 'w', encoding='utf-8') as file:
+        json.dump({"source_sha256": source_sha256}, file)
+
+
+def read_sidecar(path):
+    """
+    :return: The SHA-256 of the weights the artifact was exported from, None if unknown
+    """
+    if not os.path.isfile(path + '.json'):
+        return None
+    with open(path + '.json', 'r', encoding='utf-8') as file:
+        return json.load(file).get("source_sha256")
+
+
+def fixture_inputs(name, seed=0):
+    """
+    The fixed inputs of the parity check of each network.
+        - lrnet: smooth random landmark trajectories, in the [-1, 1] range of the normalized landmarks.
+        - retinaface / fan: random BGR-mean-subtracted images / [0, 1] face crops.
+    :return: list of input batches (torch.Tensor)
+    """
+    rng = np.random.RandomState(seed)
+    if name == 'lrnet':
+        base = rng.uniform(-0.6, 0.6, (32, 1, 136))
+        steps = np.cumsum(rng.normal(0, 0.01, (32, 16, 136)), axis=1)
+        return [torch.from_numpy(base + steps).float()]
+    if name == 'retinaface':
+        return [torch.from_numpy(rng.uniform(-120, 140, (2, 3, h, w))).float() for h, w in ((240, 320), (360, 640))]
+    if name == 'fan':
+        return [torch.from_numpy(rng.uniform(0, 1, (4, 3, 256, 256))).float()]
+    raise ValueError(f"Unknown network: {name}")
+
+
+class OnnxModule(object):
+    """
+    An ONNX Runtime session with the calling convention of the torch module it was exported from.
+    """
+    def __init__(self, path):
+        import onnxruntime
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, providers=onnxruntime.get_available_providers())
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, *inputs):
+        feed = {name: x.detach().cpu().numpy() for name, x in zip(self.input_names, inputs)}
+        outputs = [torch.from_numpy(out).to(inputs[0].device) for out in self.session.run(None, feed)]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+    def eval(self):
+        return self
+
+
+def load_artifact(name, runtime, quantized=False, export_dir=EXPORT_DIR):
+    path = artifact_path(name, runtime, quantized, export_dir)
+    if runtime == 'torchscript':
+        return torch.jit.load(path, map_location='cpu').eval()
+    if runtime == 'onnx':
+        return OnnxModule(path)
+    raise ValueError(f"Unknown runtime: {runtime}")
+
+
+def check_parity(name, reference, candidate, quantized=False):
+    """
+    Compare the outputs of `candidate` to the eager `reference` on the fixture set of `name`.
+    :return: (ok, max absolute difference)
+    """
+    max_diff = 0.0
+    with torch.no_grad():
+        for x in fixture_inputs(name):
+            expected, actual = reference(x.to(module_device(reference))), candidate(x)
+            if isinstance(expected, list):  # Stacked hourglass: only the last output is used.
+                expected = expected[-1]
+            if isinstance(actual, list):
+                actual = actual[-1]
+            if isinstance(expected, torch.Tensor):
+                expected, actual = (expected,), (actual,)
+            for e, a in zip(expected, actual):
+                max_diff = max(max_diff, float((e.cpu() - a.cpu()).abs().max()))
+    return max_diff <= PARITY_TOLERANCE[name][1 if quantized else 0], max_diff
+
+
+def module_device(module):
+    return next(module.parameters()).device
+
+
+def select_module(name, module, runtime=None, quantized=None):
+    """
+    :param module: The eager network loaded from the `.pth` weights
+    :return: The artifact selected by `RUNTIME` if it passes the parity check, otherwise `module`
+    """
+    runtime = runtime or RUNTIME
+    quantized = QUANTIZED if quantized is None else quantized
+    if runtime == 'torch':
+        return module
+    if module_device(module).type != 'cpu':
+        logging.info(f"{name} 在 {module_device(module)} 上運行，不使用 {runtime} 模型（僅支援 CPU）")
+        return module
+    source_sha256 = read_sidecar(artifact_path(name, runtime, quantized))
+    if source_sha256 != weights_sha256(module):
+        logging.warning(f"{name} 的 {runtime} 模型不是由目前的權重導出的，使用 PyTorch")
+        return module
+    try:
+        candidate = load_artifact(name, runtime, quantized)
+    except Exception as e:
+        logging.warning(f"無法加載 {name} 的 {runtime} 模型，使用 PyTorch：{str(e)}")
+        return module
+    ok, max_diff = check_parity(name, module, candidate, quantized)
+    if not ok:
+        logging.warning(f"{name} 的 {runtime} 模型未通過一致性檢查（最大誤差 {max_diff:.2e}），使用 PyTorch")
+        return module
+    logging.info(f"使用 {runtime}{' int8' if quantized else ''} 模型：{name}（最大誤差 {max_diff:.2e}）")
+    return candidate
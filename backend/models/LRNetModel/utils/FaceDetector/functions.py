@@ -5,18 +5,20 @@ import numpy as np
 import os
 
 from .configs.loader import load_yaml
-from .layers.functions.prior_box import PriorBox
+from .layers.functions.prior_box import get_priors
 from .utils.nms.py_cpu_nms import py_cpu_nms
 from .models.retinaface import RetinaFace
 from .utils.box_utils import decode
+from torchvision.ops import batched_nms
 from tqdm import tqdm
 
 """
 Load the configures and args
 """
-args = load_yaml('utils/FaceDetector/configs/args_face_detector.yaml')
-cfg_mnet = load_yaml('utils/FaceDetector/configs/cfg_mnet.yaml')
-cfg_re50 = load_yaml('utils/FaceDetector/configs/cfg_re50.yaml')
+root_dir = os.path.dirname(os.path.abspath(__file__))
+args = load_yaml(os.path.join(root_dir, 'configs/args_face_detector.yaml'))
+cfg_mnet = load_yaml(os.path.join(root_dir, 'configs/cfg_mnet.yaml'))
+cfg_re50 = load_yaml(os.path.join(root_dir, 'configs/cfg_re50.yaml'))
 
 
 def check_keys(model, pretrained_state_dict):
@@ -41,7 +43,7 @@ def remove_prefix(state_dict, prefix):
 
 def load_model(model, pretrained_path, load_to_cpu):
     # print('Loading pretrained model from {}'.format(pretrained_path))
-    pretrained_path = os.path.join(os.getcwd(), "utils/FaceDetector/weights", pretrained_path)
+    pretrained_path = os.path.join(root_dir, "weights", pretrained_path)
 
     if load_to_cpu:
         pretrained_dict = torch.load(pretrained_path, map_location=lambda storage, loc: storage)
@@ -95,12 +97,13 @@ def get_slices(frame_num, batch_size):
     return slices
 
 
-def predict_face_box_batch(net, imgs):
+def predict_face_box_batch(net, imgs, single_face=True):
     """
     - Predict the face bounding-box from the input image sequence (video)
     - Modified from the original `predict_face_box` to support batch-prediction, improving the efficiency.
     :param net: RetinaFace
     :param imgs: Image sequence [Type: list][Shape: (N, (H, W, C))]
+    :param single_face: Take the best candidate of each frame without running the NMS (see `postprocess_batch`).
     :return: face_boxes [Type: list]
              confidence_scores [Type: list]
     """
@@ -151,17 +154,11 @@ def predict_face_box_batch(net, imgs):
     frame_num = len(imgs)
     slices = get_slices(frame_num, batch_size)
 
-    priorbox = PriorBox(cfg, image_size=(im_height, im_width))
-    priors = priorbox.forward()
-    priors = priors.to(device)
-    prior_data = priors.data
+    prior_data = get_priors(cfg, (im_height, im_width), device)
 
     face_boxes = []
     confidence_scores = []
 
-    locs = []
-    confs = []
-
     for batch_slice in tqdm(slices):
         samples = []
         img_batch = imgs[batch_slice]
@@ -173,55 +170,66 @@ def predict_face_box_batch(net, imgs):
         img_batch = torch.from_numpy(np.concatenate(samples))
         img_batch = img_batch.to(device)
         loc, conf, _ = net(img_batch)  # forward pass
-        locs.append(loc)
-        confs.append(conf)
 
-    # Concat the loc and conf
-    locs = torch.cat(locs, dim=0)
-    confs = torch.cat(confs, dim=0)
+        # Post-process each batch right after its forward pass, only one batch of loc/conf is kept on the device.
+        for dets in postprocess_batch(loc, conf, prior_data, scale, resize, cfg['variance'],
+                                      single_face):
+            """
+            Handle the situation when the len of dets[] is zero
+            """
+            if len(dets) == 0:
+                if len(face_boxes) == 0:
+                    face_boxes.append((0, 0, 1, 1))  # A meaning less box. Just to avoid the crash.
+                else:
+                    face_boxes.append(face_boxes[-1])
+                confidence_scores.append(0)
+            else:
+                # Only return the first face
+                det = dets[0]
+                box, score = (det[0], det[1], det[2], det[3]), det[4]
 
-    # print("Misc-Stage")
-    for loc, conf in zip(locs, confs):
-        boxes = decode(loc.data.squeeze(0), prior_data, cfg['variance'])
-        boxes = boxes * scale / resize
-        boxes = boxes.cpu().numpy()
-        scores = conf.squeeze(0).data.cpu().numpy()[:, 1]
+                face_boxes.append(box)
+                confidence_scores.append(score)
 
-        # ignore low scores
-        inds = np.where(scores > args['confidence_threshold'])[0]
-        boxes = boxes[inds]
-        scores = scores[inds]
+    return face_boxes, confidence_scores
 
+
+def postprocess_batch(loc, conf, prior_data, scale, resize, variance, single_face=False):
+    """
+    Threshold, decode and NMS the predictions of a whole batch with tensor ops.
+    :param loc: [Shape: (B, num_priors, 4)]
+    :param conf: [Shape: (B, num_priors, 2)]
+    :param single_face: Only keep the highest-scoring candidate of each image, skipping the NMS.
+                        It is always kept by the NMS, so the result equals `dets[0]` of the full path.
+    :return: dets of each image [Type: list][Shape: (B, (K, 5))], sorted by score in descending order
+    """
+    scores = conf.data[..., 1]
+    if single_face:
+        scores, prior_inds = scores.max(dim=1)
+        image_inds = torch.nonzero(scores > args['confidence_threshold'], as_tuple=True)[0]
+        prior_inds = prior_inds[image_inds]
+        scores = scores[image_inds]
+    else:
         # keep top-K before NMS
-        order = scores.argsort()[::-1]
-
-        boxes = boxes[order]
-        scores = scores[order]
-
-        # do NMS
-        dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
-        keep = py_cpu_nms(dets, args['nms_threshold'])
-        # keep = nms(dets, args['nms_threshold'],force_cpu=args['cpu'])
-        dets = dets[keep, :]
-
-        """
-        Handle the situation when the len of dets[] is zero
-        """
-        if len(dets) == 0:
-            if len(face_boxes) == 0:
-                face_boxes.append((0, 0, 1, 1))  # A meaning less box. Just to avoid the crash.
-            else:
-                face_boxes.append(face_boxes[-1])
-            confidence_scores.append(0)
-        else:
-            # Only return the first face
-            det = dets[0]
-            box, score = (det[0], det[1], det[2], det[3]), det[4]
+        scores, prior_inds = scores.topk(min(args['top_k'], scores.shape[1]), dim=1)
+        # ignore low scores
+        image_inds, ranks = torch.nonzero(scores > args['confidence_threshold'], as_tuple=True)
+        prior_inds = prior_inds[image_inds, ranks]
+        scores = scores[image_inds, ranks]
 
-            face_boxes.append(box)
-            confidence_scores.append(score)
+    # Only the remaining candidates are decoded.
+    boxes = decode(loc.data[image_inds, prior_inds], prior_data[prior_inds], variance)
+    boxes = boxes * scale / resize
 
-    return face_boxes, confidence_scores
+    if not single_face:
+        # do NMS, separately for each image of the batch (kept indices are sorted by decreasing score)
+        keep = batched_nms(boxes, scores, image_inds, args['nms_threshold'])
+        boxes, scores, image_inds = boxes[keep], scores[keep], image_inds[keep]
+
+    dets = torch.cat((boxes, scores.unsqueeze(1)), dim=1).cpu().numpy()
+    image_inds = image_inds.cpu().numpy()
+    # keep top-K faster NMS
+    return [dets[image_inds == i][:args['keep_top_k']] for i in range(loc.shape[0])]
 
 
 def predict_face_box(net, frame):
@@ -267,10 +275,7 @@ def predict_face_box(net, frame):
 
     loc, conf, _ = net(img)  # forward pass
 
-    priorbox = PriorBox(cfg, image_size=(im_height, im_width))
-    priors = priorbox.forward()
-    priors = priors.to(device)
-    prior_data = priors.data
+    prior_data = get_priors(cfg, (im_height, im_width), device)
     boxes = decode(loc.data.squeeze(0), prior_data, cfg['variance'])
     boxes = boxes * scale / resize
     boxes = boxes.cpu().numpy()
@@ -282,7 +287,7 @@ def predict_face_box(net, frame):
     scores = scores[inds]
 
     # keep top-K before NMS
-    order = scores.argsort()[::-1]
+    order = scores.argsort()[::-1][:args['top_k']]
 
     boxes = boxes[order]
     scores = scores[order]
@@ -293,6 +298,9 @@ def predict_face_box(net, frame):
     # keep = nms(dets, args['nms_threshold'],force_cpu=args['cpu'])
     dets = dets[keep, :]
 
+    # keep top-K faster NMS
+    dets = dets[:args['keep_top_k'], :]
+
     # Only return the first face
     det = dets[0]
     box, score = (det[0], det[1], det[2], det[3]), det[4]
@@ -1,7 +1,7 @@
 import torch
-from itertools import product as product
-import numpy as np
 from math import ceil
+from collections import OrderedDict
+import threading
 
 
 class PriorBox(object):
@@ -15,20 +15,55 @@ class PriorBox(object):
         self.name = "s"
 
     def forward(self):
+        """
+        Vectorized anchor generation. Same order as the original nested loops:
+        feature map -> row (i) -> column (j) -> min_size, each anchor being [cx, cy, s_kx, s_ky].
+        Computed in float64 like the python floats before, then cast to float32.
+        """
         anchors = []
         for k, f in enumerate(self.feature_maps):
-            min_sizes = self.min_sizes[k]
-            for i, j in product(range(f[0]), range(f[1])):
-                for min_size in min_sizes:
-                    s_kx = min_size / self.image_size[1]
-                    s_ky = min_size / self.image_size[0]
-                    dense_cx = [x * self.steps[k] / self.image_size[1] for x in [j + 0.5]]
-                    dense_cy = [y * self.steps[k] / self.image_size[0] for y in [i + 0.5]]
-                    for cy, cx in product(dense_cy, dense_cx):
-                        anchors += [cx, cy, s_kx, s_ky]
+            min_sizes = torch.tensor(self.min_sizes[k], dtype=torch.float64)
+            num_sizes = len(self.min_sizes[k])
+            s_kx = min_sizes / self.image_size[1]
+            s_ky = min_sizes / self.image_size[0]
+            dense_cx = (torch.arange(f[1], dtype=torch.float64) + 0.5) * self.steps[k] / self.image_size[1]
+            dense_cy = (torch.arange(f[0], dtype=torch.float64) + 0.5) * self.steps[k] / self.image_size[0]
+            cy, cx = torch.meshgrid(dense_cy, dense_cx, indexing='ij')
+            anchor = torch.stack([
+                cx.unsqueeze(-1).expand(f[0], f[1], num_sizes),
+                cy.unsqueeze(-1).expand(f[0], f[1], num_sizes),
+                s_kx.expand(f[0], f[1], num_sizes),
+                s_ky.expand(f[0], f[1], num_sizes),
+            ], dim=-1)
+            anchors.append(anchor.reshape(-1, 4))
 
         # back to torch land
-        output = torch.Tensor(anchors).view(-1, 4)
+        output = torch.cat(anchors, dim=0).float()
         if self.clip:
             output.clamp_(max=1, min=0)
         return output
+
+
+_prior_cache = OrderedDict()
+_prior_cache_lock = threading.Lock()
+PRIOR_CACHE_SIZE = 8
+
+
+def get_priors(cfg, image_size, device):
+    """
+    Memoized PriorBox(cfg, image_size).forward() on `device`, keyed by (cfg name, height, width, device).
+    All the videos of the same resolution share one prior tensor, so it must not be modified in place.
+    """
+    key = (cfg['name'], image_size[0], image_size[1], str(device))
+    with _prior_cache_lock:
+        priors = _prior_cache.get(key)
+        if priors is not None:
+            _prior_cache.move_to_end(key)
+            return priors
+    priors = PriorBox(cfg, image_size=image_size).forward().to(device)
+    with _prior_cache_lock:
+        _prior_cache[key] = priors
+        _prior_cache.move_to_end(key)
+        while len(_prior_cache) > PRIOR_CACHE_SIZE:
+            _prior_cache.popitem(last=False)
+    return priors
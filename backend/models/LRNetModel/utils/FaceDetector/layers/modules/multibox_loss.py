@@ -1,10 +1,11 @@
+import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 from ...utils.box_utils import match, log_sum_exp
 from ...configs.loader import load_yaml
-cfg_mnet = load_yaml('utils/FaceDetector/configs/cfg_mnet.yaml')
+cfg_mnet = load_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../configs/cfg_mnet.yaml'))
 GPU = cfg_mnet['gpu_train']
 
 class MultiBoxLoss(nn.Module):
@@ -60,8 +60,8 @@ class RetinaFace(nn.Module):
         if cfg['name'] == 'mobilenet0.25':
             backbone = MobileNetV1()
             if cfg['pretrain']:
-                pretrained_weights = os.path.join(os.getcwd(),
-                                                  "utils/FaceDetector/weights/mobilenetV1X0.25_pretrain.tar")
+                pretrained_weights = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "../weights/mobilenetV1X0.25_pretrain.tar")
                 checkpoint = torch.load(pretrained_weights, map_location=torch.device('cpu'))
                 from collections import OrderedDict
                 new_state_dict = OrderedDict()
@@ -0,0 +1,45 @@
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from ..utils import shared
+
+"""
+Process pool of the intra-video parallel detection (see `landmark_utils.iter_frames_landmarks`).
+    - `shared.detect_workers` processes, each holding its own warm detector (FaceAlignment, RetinaFace).
+    - The torch threads of the node are split between the processes, so they do not oversubscribe the cores.
+    - Each inference worker (see `executorModel.py`) owns its pool: the node runs
+    INFERENCE_WORKERS * LRNET_DETECT_WORKERS detection processes.
+"""
+
+
+def _init_detection_worker(threads):
+    torch.set_num_threads(threads)
+    from .detector_pool import init_detector_pool
+    init_detector_pool(1)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_detection_workers():
+    """
+    :return: The process pool of the parallel detection, created on first use.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = shared.detect_workers
+                threads = max((os.cpu_count() or 1) // workers, 1)
+                logging.info(f"啟動 {workers} 個檢測進程，每個進程 {threads} 個線程")
+                # 'spawn': forking a process that already runs torch threads may deadlock.
+                _executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_init_detection_worker, initargs=(threads,))
+                atexit.register(_executor.shutdown, cancel_futures=True)
+    return _executor
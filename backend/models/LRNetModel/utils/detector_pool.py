@@ -0,0 +1,109 @@
+import queue
+import threading
+from contextlib import contextmanager
+import numpy as np
+import torch
+import face_alignment
+from ..utils import shared
+from ..runtime import select_module
+
+
+class Detector(object):
+    """
+    A warm face detector + landmarker bundle.
+        - fa: FaceAlignment module (FAN landmarker, with blazeface as face detector or a 'folder' dummy detector).
+        - net: RetinaFace detector, only initialized when `shared.face_detector_selection` is 'retinaface'.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.net = None
+        if shared.face_detector_selection == 'blazeface':
+            self.fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, face_detector='blazeface',
+                                                   device=device)
+        else:
+            from .FaceDetector.functions import get_detector
+            self.net = get_detector()  # Initialize the retinaface detector.
+            self.fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, face_detector='folder',
+                                                   device=device)
+        # Swap in the exported TorchScript / ONNX networks, if selected and consistent with the `.pth` ones.
+        if self.net is not None:
+            self.net = select_module('retinaface', self.net)
+        self.fa.face_alignment_net = select_module('fan', self.fa.face_alignment_net)
+
+    def warmup(self):
+        """
+        Run one dummy inference through every network, so the first request does not pay the lazy initialization
+        (cudnn autotune, allocator growth, etc.).
+        """
+        dummy = np.zeros((256, 256, 3), dtype=np.uint8)
+        face_box = np.array([[64, 64, 192, 192]])
+        with torch.no_grad():
+            if self.net is None:
+                self.fa.face_detector.detect_from_image(dummy)
+            else:
+                from .FaceDetector.functions import predict_face_box_batch
+                predict_face_box_batch(self.net, [dummy])
+            self.fa.get_landmarks_from_image(dummy, detected_faces=face_box)
+
+
+class DetectorPool(object):
+    """
+    A fixed-size pool of warm detectors shared by the requests of one worker.
+    Each request checks out one detector for the whole detection stage and returns it afterwards.
+    """
+    def __init__(self, size=1, device=None):
+        assert size > 0
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == 'cpu':
+            print("[WARNING]: Preprocessing codes running on CPU, which would be slow. For optimal performance, "
+                  "consider use the pytorch-cuda instead")
+        self.size = size
+        self.device = device
+        self._queue = queue.Queue(maxsize=size)
+        for _ in range(size):
+            detector = Detector(device)
+            detector.warmup()
+            self._queue.put(detector)
+
+    def acquire(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def release(self, detector):
+        self._queue.put(detector)
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        detector = self.acquire(timeout)
+        try:
+            yield detector
+        finally:
+            self.release(detector)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_detector_pool(size=None, device=None):
+    """
+    Build (or rebuild) the process-wide detector pool.
+    :param size: Number of detectors in this worker, default to `shared.detector_pool_size` (Int)
+    :param device: 'cpu' or 'cuda', auto-selected if None (str)
+    """
+    global _pool
+    with _pool_lock:
+        _pool = DetectorPool(size or shared.detector_pool_size, device)
+    return _pool
+
+
+def get_detector_pool():
+    """
+    :return: The process-wide detector pool, lazily built on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DetectorPool(shared.detector_pool_size)
+    return _pool
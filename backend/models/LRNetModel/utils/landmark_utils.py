@@ -1,13 +1,19 @@
 from tqdm import tqdm
 import numpy as np
 import cv2
-import face_alignment
 from os.path import join
+from itertools import chain
+from collections import deque
 from ..utils import shared
+from .detector_pool import get_detector_pool
+from .detection_workers import get_detection_workers
 from datetime import datetime
 import torch
+from face_alignment.utils import crop, flip, get_preds_fromhm
 # from .deprecated import track_bidirectional, landmark_align  # DEPRECATED codes, just for reference.
 
+CENTER_Y_OFFSET = 0.12  # Same as face_alignment: shift the face center up before cropping for the FAN.
+
 
 def shape_to_face(shape, width, height, scale=1.2, assign_face_size=None, shift_threshold=2.0, center_prev=None):
     """
@@ -106,9 +112,256 @@ def predict_single_frame(frame, fa, face_box=None):
         return 1, shape, score
 
 
+def predict_batch_frames(frames, fa, detected_faces):
+    """
+    Batched version of `predict_single_frame`: the faces of all frames go through the FAN in one forward pass.
+        - Only the face ROI of each frame is cropped (256*256) for the FAN, whatever the resolution of the frame.
+    :param
+    frames: A batch of frames of the video [Type: list][Shape: (B, (H, W, C))]
+    fa: FaceAlignment module.
+    detected_faces: Detected faces of each frame, in frame coordinates [Type: list][Shape: (B, (K, 4+))]
+    :return: (face_num, shape, score) of each frame [Type: list]
+        - The frames where no face is detected get (0, None, 0), the same as `predict_single_frame`.
+    """
+    results = [(0, None, 0)] * len(frames)
+    index, centers, scales, crops = [], [], [], []
+    for i, (frame, faces) in enumerate(zip(frames, detected_faces)):
+        if len(faces) == 0:
+            continue
+        # Only the first face is used, just like `predict_single_frame`.
+        d = faces[0]
+        center = np.array([d[2] - (d[2] - d[0]) / 2.0, d[3] - (d[3] - d[1]) / 2.0])
+        center[1] = center[1] - (d[3] - d[1]) * CENTER_Y_OFFSET
+        scale = (d[2] - d[0] + d[3] - d[1]) / fa.face_detector.reference_scale
+        index.append(i)
+        centers.append(center)
+        scales.append(scale)
+        crops.append(crop(frame, center, scale).transpose((2, 0, 1)).astype(np.float32) / 255.0)
+    if len(crops) == 0:
+        return results
+
+    with torch.no_grad():
+        inp = torch.from_numpy(np.stack(crops)).to(fa.device)
+        out = _fan_forward(fa, inp)
+        if fa.flip_input:
+            out += flip(_fan_forward(fa, flip(inp)), is_label=True)
+    out = out.cpu().numpy()
+
+    for k, i in enumerate(index):
+        _, pts_img, scores = get_preds_fromhm(out[k:k + 1], centers[k], scales[k])
+        shape = pts_img.reshape(68, 2).astype(int)
+        results[i] = (1, shape, np.average(scores.squeeze(0)))
+    return results
+
+
+def _fan_forward(fa, inp):
+    out = fa.face_alignment_net(inp)
+    if isinstance(out, list):  # Stacked hourglass: only the last output is used.
+        out = out[-1]
+    return out.detach()
+
+
+def iter_frames_landmarks(frames, batch_size=None, detect_interval=None):
+    """
+    Detect the face and its landmarks, consuming the frames incrementally in small batches.
+        - A warm detector is checked out from the detector pool while the generator is running.
+        - Only `batch_size` frames are buffered. Each batch is one face detection and one FAN forward pass.
+    :param frames: Image sequence (the video) [Type: iterable][Shape: (N, (H, W, C))]
+    :param batch_size: Frames per forward pass, default to `shared.landmark_batch_size` (Int)
+    :param detect_interval: Run the face detector every `detect_interval` frames only (see `_iter_keyframes_landmarks`),
+                            default to `shared.detect_interval` (Int)
+    :return: (face_num, shape, score) of each frame [Type: generator]
+    """
+    batch_size = batch_size or shared.landmark_batch_size
+    detect_interval = detect_interval or shared.detect_interval
+    if detect_interval == 1 and shared.detect_workers > 1:
+        yield from _iter_parallel_landmarks(frames, batch_size)
+        return
+    with get_detector_pool().checkout() as detector:
+        if detect_interval > 1:
+            yield from _iter_keyframes_landmarks(frames, detector, detect_interval)
+            return
+        box_prev = None
+        for batch in iter_batches(frames, batch_size):
+            detected_faces, box_prev = detect_batch_faces(batch, detector, box_prev)
+            for result in predict_batch_frames(batch, detector.fa, detected_faces):
+                yield result
+
+
+def _iter_parallel_landmarks(frames, batch_size, max_size=None):
+    """
+    Parallel mode of `iter_frames_landmarks`: the batches are detected by the processes of the detection workers
+    (see `detection_workers.py`), each with its own warm detector, and the results are yielded in order.
+        - The batches are the same as in the sequential mode, so are the results.
+        - A retinaface batch whose first frame has no detection depends on the box of the former batch: it is
+        detected again in this process once the former box is known (rare, only when the face is missed).
+    """
+    max_size = shared.detect_max_size if max_size is None else max_size
+    executor = get_detection_workers()
+    pending = deque()
+
+    def ordered():
+        for batch in iter_batches(frames, batch_size):
+            pending.append((batch, executor.submit(detect_batch_landmarks, batch, max_size)))
+            if len(pending) >= 2 * shared.detect_workers:  # Bound the decoded frames in flight.
+                yield pending.popleft()
+        while len(pending) != 0:
+            yield pending.popleft()
+
+    box_prev = None
+    try:
+        for batch, future in ordered():
+            results, box_last, first_missed = future.result()
+            if first_missed and box_prev is not None:
+                with get_detector_pool().checkout() as detector:
+                    detected_faces, box_last = detect_batch_faces(batch, detector, box_prev, max_size)
+                    results = predict_batch_frames(batch, detector.fa, detected_faces)
+            box_prev = box_last
+            yield from results
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def detect_batch_landmarks(batch, max_size=None):
+    """
+    Run in the detection workers: the faces and landmarks of one batch, without the box of the former batch.
+    :return: results (see `predict_batch_frames`), box_prev after the batch,
+             first_missed (the retinaface box of the first frame would have come from the former batch)
+    """
+    with get_detector_pool().checkout() as detector:
+        detected_faces, box_prev = detect_batch_faces(batch, detector, None, max_size)
+        results = predict_batch_frames(batch, detector.fa, detected_faces)
+    first_missed = detector.net is not None and detected_faces[0][0, 4] == 0
+    return results, box_prev, first_missed
+
+
+def _iter_keyframes_landmarks(frames, detector, detect_interval, redetect_score=None):
+    """
+    Tracking mode of `iter_frames_landmarks`: the face detector only runs on keyframes,
+        - every `detect_interval` frames,
+        - when no face was found in the former frame,
+        - or when the landmarks predicted in the box of the former landmarks score below `redetect_score`.
+    On the other frames, the face box given to the FAN is derived from the former frame's landmarks by
+    `shape_to_face`. Each box depends on the former landmarks, so the FAN runs frame by frame here.
+    :param redetect_score: Default to `shared.redetect_score` (float)
+    """
+    redetect_score = shared.redetect_score if redetect_score is None else redetect_score
+    box_prev, shape_prev, center_prev = None, None, None
+    since_detect = 0
+    detected_num, frames_num = 0, 0
+    for frame in frames:
+        frames_num += 1
+        result = None
+        if shape_prev is not None and since_detect < detect_interval:
+            height, width = frame.shape[:2]
+            face, _, center_prev = shape_to_face(shape_prev, width, height, 1.2, center_prev=center_prev)
+            result = predict_batch_frames([frame], detector.fa, [np.array([face])])[0]
+            if result[0] == 0 or result[2] < redetect_score:
+                result = None
+        if result is None:
+            detected_faces, box_prev = detect_batch_faces([frame], detector, box_prev)
+            result = predict_batch_frames([frame], detector.fa, detected_faces)[0]
+            detected_num += 1
+            since_detect, center_prev = 0, None
+        since_detect += 1
+        shape_prev = result[1]
+        yield result
+    print("Face detector ran on {} / {} frames".format(detected_num, frames_num))
+
+
+def detection_scale(height, width, max_size=None):
+    """
+    Resolution policy of the face detection: a frame whose longer side exceeds `max_size` is detected on a
+    downscaled copy. The landmarks are still predicted on the full-resolution face ROI.
+    :param max_size: Default to `shared.detect_max_size`, 0 to always detect at the native resolution (Int)
+    :return: The factor from the frame to its detection copy (float, <= 1)
+    """
+    max_size = shared.detect_max_size if max_size is None else max_size
+    if max_size <= 0 or max(height, width) <= max_size:
+        return 1.0
+    return max_size / max(height, width)
+
+
+def detect_batch_faces(batch, detector, box_prev=None, max_size=None):
+    """
+    Detect the faces of one batch, on downscaled copies of the frames if needed (see `detection_scale`).
+    :param batch: A batch of frames of the video [Type: list][Shape: (B, (H, W, C))]
+    :param detector: A warm `Detector` of the detector pool
+    :param box_prev: The retinaface box of the former frame, for the frames without any detection
+    :return: detected_faces in frame coordinates [Type: list][Shape: (B, (K, 5))], box_prev
+        - The last column is the confidence score of the detection, 0 for the retinaface boxes of the frames without
+        any detection.
+    """
+    height, width = batch[0].shape[:2]
+    scale = detection_scale(height, width, max_size)
+    ratio = None
+    if scale < 1:
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        batch = [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in batch]
+        ratio = np.array([width / size[0], height / size[1]] * 2)  # From the detection copy to the frame
+
+    if detector.net is None:  # Using the blazeface as face detector
+        detected_faces = detector.fa.face_detector.detect_from_batch(
+            torch.from_numpy(np.stack(batch).transpose((0, 3, 1, 2))))
+        if ratio is not None:
+            for faces in detected_faces:
+                faces[:, :4] *= ratio
+    else:  # Using the retinaface as face detector
+        face_boxes, confidence_scores, box_prev = _predict_batch_boxes(batch, detector.net, box_prev, ratio)
+        detected_faces = []
+        for face_box, confidence in zip(face_boxes, confidence_scores):
+            face_box = np.array(face_box)
+            face = np.append(face_box, np.array(confidence, dtype=face_box.dtype))
+            detected_faces.append(np.expand_dims(face, axis=0))
+    return detected_faces, box_prev
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) != 0:
+        yield batch
+
+
+def _predict_batch_boxes(batch, net, box_prev, ratio=None):
+    """
+    Retinaface detection on one batch.
+        - The boxes are mapped back to frame coordinates by `ratio` when the batch is a downscaled copy.
+        - A frame without any detection (confidence score 0) reuses the box of the former frame,
+        also across the batch boundary, just like detecting the whole video at once.
+    :return: face_boxes, confidence_scores, box_prev
+    """
+    from .FaceDetector.functions import predict_face_box_batch
+    face_boxes, confidence_scores = predict_face_box_batch(net, batch)
+    assert len(batch) == len(face_boxes)
+    for i, confidence in enumerate(confidence_scores):
+        if ratio is not None:
+            face_boxes[i] = tuple(np.array(face_boxes[i]) * ratio)
+        if confidence == 0 and box_prev is not None:
+            face_boxes[i] = box_prev
+        box_prev = face_boxes[i]
+    return face_boxes, confidence_scores, box_prev
+
+
 def check_and_merge(location, forward, feedback, P_predict, status_fw=None, status_fb=None):
+    """
+    Merge the detected and the tracked landmark locations of one frame pair with a per-point Kalman filter.
+        - Vectorized over the 68 points with boolean masks, the results are bit-identical to the former per-point
+        loops. (The filter is recursive over the frames, so only the points can be processed at once.)
+    :param location: Detected locations of [former frame, current frame] [Shape: (2, 68, 2)]
+    :param forward: Forward tracked locations of [former frame, current frame] [Shape: (2, 68, 2)]
+    :param feedback: Feedback tracked locations of [former frame, current frame] [Shape: (2, 68, 2)]
+    :param P_predict: Estimate variance of each point, updated in place [Shape: (68,)]
+    :param status_fw: Status of the forward optical flow [Shape: (68, 1)]
+    :param status_fb: Status of the feedback optical flow [Shape: (68, 1)]
+    :return: location_merge [Shape: (68, 2)], check [Shape: (68,)], P_predict [Shape: (68,)]
+    """
     num_pts = 68
-    check = [True] * num_pts
 
     target = location[1]
     forward_predict = forward[1]
@@ -117,28 +370,21 @@ def check_and_merge(location, forward, feedback, P_predict, status_fw=None, stat
     forward_base = forward[0]  # Also equal to location[0]
     feedback_predict = feedback[0]
     feedback_diff = feedback_predict - forward_base
-    feedback_dist = np.linalg.norm(feedback_diff, axis=1, keepdims=True)
+    feedback_dist = np.linalg.norm(feedback_diff, axis=1)
 
     # For Kalman Filtering
     detect_diff = location[1] - location[0]
-    detect_dist = np.linalg.norm(detect_diff, axis=1, keepdims=True)
+    detect_dist = np.linalg.norm(detect_diff, axis=1)
     predict_diff = forward[1] - forward[0]
-    predict_dist = np.linalg.norm(predict_diff, axis=1, keepdims=True)
-    predict_dist[np.where(predict_dist == 0)] = 1  # Avoid nan
-    P_detect = (detect_dist / predict_dist).reshape(num_pts)
-
-    for ipt in range(num_pts):
-        if feedback_dist[ipt] > 2:  # When use float
-            check[ipt] = False
-
-    if status_fw is not None and np.sum(status_fw) != num_pts:
-        for ipt in range(num_pts):
-            if status_fw[ipt][0] == 0:
-                check[ipt] = False
-    if status_fw is not None and np.sum(status_fb) != num_pts:
-        for ipt in range(num_pts):
-            if status_fb[ipt][0] == 0:
-                check[ipt] = False
+    predict_dist = np.linalg.norm(predict_diff, axis=1)
+    predict_dist[predict_dist == 0] = 1  # Avoid nan
+    P_detect = detect_dist / predict_dist
+
+    check = ~(feedback_dist > 2)  # When use float
+    if status_fw is not None:
+        check &= np.reshape(status_fw, num_pts) != 0
+        check &= np.reshape(status_fb, num_pts) != 0
+
     location_merge = target.copy()
     # Merge the results:
     """
@@ -147,14 +393,13 @@ def check_and_merge(location, forward, feedback, P_predict, status_fw=None, stat
 
     Q = 0.3  # Process variance
 
-    for ipt in range(num_pts):
-        if check[ipt]:
-            # Kalman parameter
-            P_predict[ipt] += Q
-            K = P_predict[ipt] / (P_predict[ipt] + P_detect[ipt])
-            location_merge[ipt] = forward_predict[ipt] + K * (target[ipt] - forward_predict[ipt])
-            # Update the P_predict by the current K
-            P_predict[ipt] = (1 - K) * P_predict[ipt]
+    # Kalman parameter
+    P_predict[check] += Q
+    P_check = P_predict[check]
+    K = P_check / (P_check + P_detect[check])
+    location_merge[check] = forward_predict[check] + K[:, np.newaxis] * (target[check] - forward_predict[check])
+    # Update the P_predict by the current K
+    P_predict[check] = (1 - K) * P_check
     return location_merge, check, P_predict
 
 
@@ -164,11 +409,26 @@ def detect_frames_track(frames, video, fps):
     :param frames: Image sequence (the video) [Type: list][Shape: (N, (H, W, C))]
     :param video: The name of the video which includes suffixes (str)
     :param fps: The fps of the video (Int)
-    :return: calibrated_normalized_landmarks [Type: list][Shape: (N, 136)]
+    :return: calibrated_normalized_landmarks [Type: np.ndarray (float32)][Shape: (N, 136)]
+    """
+    assert len(frames) != 0
+    return detect_video_track(lambda: iter(frames), video, fps)
+
+
+def detect_video_track(open_frames, video, fps, stats=None):
+    """
+    Streaming version of `detect_frames_track`.
+        - The video is read twice: the first pass detects the landmarks (only the shapes are kept), the second pass
+        crops the faces and tracks them. The stable face size of the whole video is needed before cropping.
+        - Only the two normalized faces of the current tracking segment are kept in memory, so the peak memory
+        does not depend on the length of the video.
+    :param open_frames: A callable which returns a new iterator over the frames [Type: callable]
+    :param video: The name of the video which includes suffixes (str)
+    :param fps: The fps of the video (Int)
+    :param stats: Optional dict, filled with the frame count and the average landmark score of the video
+    :return: calibrated_normalized_landmarks [Type: np.ndarray (float32)][Shape: (N, 136)]
+        - Filled in place in a single preallocated buffer, which is consumed as is by the later stages.
     """
-    frames_num = len(frames)
-    assert frames_num != 0
-    frame_height, frame_width = frames[0].shape[:2]
     """
     Pre-process:
         - Detect the original face bounding-box and landmarks.
@@ -176,10 +436,9 @@ def detect_frames_track(frames, video, fps):
         - Also normalize its corresponding landmarks locations and record the scale parameter (For visualization).
     """
     face_size_normalized = 400
-    faces = []
-    locations = []
+    num_pts = 68
+    no_landmarks = np.empty((0, num_pts * 2), dtype=np.float32)
     shapes_origin = []
-    shapes_para = []  # Use to recover the shape in whole frame. ([x1, y1, scale_shape])
     skipped = 0  # Use to record how many frames have been discarded at the beginning of the video.
     """
     Note for [skipped]: We only discard the frames (no faces/landmarks are detected) at the beginning of the video.
@@ -189,38 +448,27 @@ def detect_frames_track(frames, video, fps):
     If you encounter problems, feel free to contact me on repo's issue.
     """
 
-    face_boxes = None
     lm_scores = []
     face_size_ori_s = []  # [24-01-06] To record the face size of each frame to for the stabling logic.
 
     """
     [24-01-06] Check the GPU-support here.
+        - The device is selected once by the detector pool, which also keeps the detectors warm across videos.
     """
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    if device == 'cpu':
-        print("[WARNING]: Preprocessing codes running on CPU, which would be slow. For optimal performance, "
-              "consider use the pytorch-cuda instead")
-
-    print("Face Bounding-Box Detecting:")
-    if shared.face_detector_selection == 'blazeface':
-        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, face_detector='blazeface', device=device)
-    else:
-        from demo.utils.FaceDetector.functions import get_detector, predict_face_box_batch
-        net = get_detector()  # Initialize the retinaface detector.
-        face_boxes, confidence_scores = predict_face_box_batch(net, frames)
-        assert len(frames) == len(face_boxes)
-        fa = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, face_detector='folder', device=device)
-
+    frames_iter = open_frames()
+    frame_first = next(frames_iter, None)
+    if frame_first is None:  # e.g. a burst which starts beyond the last decodable frame.
+        return no_landmarks
+    frame_height, frame_width = frame_first.shape[:2]
+    frames_iter = chain([frame_first], frames_iter)
+    del frame_first
+    if detection_scale(frame_height, frame_width) < 1:
+        print("Face detection on downscaled frames (max size: {})".format(shared.detect_max_size))
+
+    frames_num = 0
     print("Landmark Detecting:")
-    for i in tqdm(range(frames_num)):
-        frame = frames[i]
-
-        if shared.face_detector_selection == 'blazeface':
-            face_num, shape, score = predict_single_frame(frame, fa)
-        else:
-            face_box = face_boxes[i]
-            face_num, shape, score = predict_single_frame(frame, fa, face_box)
-
+    for i, (face_num, shape, score) in enumerate(iter_frames_landmarks(frames_iter)):
+        frames_num += 1
         lm_scores.append(score)
 
         """
@@ -233,7 +481,7 @@ def detect_frames_track(frames, video, fps):
             print("Landmark detection failed at index: {}".format(i))
             if len(shapes_origin) == 0:
                 skipped += 1
-                print("Skipped frame num:", skipped, ".Frame_num", frames_num)
+                print("Skipped frame num:", skipped, ".Frame_index", i)
                 continue
             shape = shapes_origin[-1]
 
@@ -257,31 +505,8 @@ def detect_frames_track(frames, video, fps):
 
         shapes_origin.append(shape)
 
-    stable_face_size = int(np.rint(np.average(face_size_ori_s)))
     assert skipped + len(shapes_origin) == frames_num
 
-    center_prev = None
-    for i, shape in enumerate(shapes_origin):
-
-        frame = frames[i + skipped]
-        face, face_size, center_curr = shape_to_face(shape, frame_width, frame_height, 1.2,
-                                                     assign_face_size=stable_face_size,
-                                                     shift_threshold=1.42,
-                                                     center_prev=center_prev)
-        center_prev = center_curr
-        faceFrame = frame[face[1]: face[3],
-                    face[0]:face[2]]
-        if face_size < face_size_normalized:
-            inter_para = cv2.INTER_CUBIC
-        else:
-            inter_para = cv2.INTER_AREA
-        face_norm = cv2.resize(faceFrame, (face_size_normalized, face_size_normalized), interpolation=inter_para)
-        scale_shape = face_size_normalized / face_size
-        shape_norm = np.rint((shape - np.array([face[0], face[1]])) * scale_shape).astype(int)
-        faces.append(face_norm)
-        shapes_para.append([face[0], face[1], scale_shape])
-        locations.append(shape_norm)
-
     """
     Record the average confidence score of the detected landmarks in the whole video.
         - Useful for eliminate some failed samples (such as some in DFDC dataset)
@@ -291,101 +516,139 @@ def detect_frames_track(frames, video, fps):
     dt = datetime.now()
     record.write(video + ' ' + str(avg_score) + ' ' + dt.isoformat(sep='/') + '\n')
     record.close()
-
-    """
-    Calibration module.
-    """
-    segment_length = 2
-    locations_sum = len(locations)
-    if locations_sum == 0:
-        return []
-    locations_track = [locations[0]]
-    num_pts = 68
-    P_predict = np.array([0] * num_pts).reshape(num_pts).astype(float)
-    print("Tracking")
-    for i in tqdm(range(locations_sum - 1)):
-        faces_seg = faces[i:i + segment_length]
-        locations_seg = locations[i:i + segment_length]
-
-        # ----------------------------------------------------------------------#
-        """
-        Numpy Version (DEPRECATED)
-        """
-
-        # locations_track_start = [locations_track[i]]
-        # forward_pts, feedback_pts = track_bidirectional(faces_seg, locations_track_start)
-        #
-        # forward_pts = np.rint(forward_pts).astype(int)
-        # feedback_pts = np.rint(feedback_pts).astype(int)
-        # merge_pt, check, P_predict = check_and_merge(locations_seg, forward_pts, feedback_pts, P_predict)
-
-        # ----------------------------------------------------------------------#
-        """
-        OpenCV Version
-        """
-
-        lk_params = dict(winSize=(15, 15),
-                         maxLevel=3,
-                         criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
-        # Use the tracked current location as input. Also use the next frame's predicted location for
-        # auxiliary initialization.
-
-        start_pt = locations_track[i].astype(np.float32)
-        target_pt = locations_seg[1].astype(np.float32)
-
-        forward_pt, status_fw, err_fw = cv2.calcOpticalFlowPyrLK(faces_seg[0], faces_seg[1],
-                                                                 start_pt, target_pt, **lk_params,
-                                                                 flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
-        feedback_pt, status_fb, err_fb = cv2.calcOpticalFlowPyrLK(faces_seg[1], faces_seg[0],
-                                                                  forward_pt, start_pt, **lk_params,
-                                                                  flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
-
-        forward_pts = [locations_track[i].copy(), forward_pt]
-        feedback_pts = [feedback_pt, forward_pt.copy()]
-
-        forward_pts = np.rint(forward_pts).astype(int)
-        feedback_pts = np.rint(feedback_pts).astype(int)
-
-        merge_pt, check, P_predict = check_and_merge(locations_seg, forward_pts, feedback_pts, P_predict, status_fw,
-                                                     status_fb)
-
-        # ----------------------------------------------------------------------#
-
-        locations_track.append(merge_pt)
+    if stats is not None:
+        stats['frames'] = frames_num
+        stats['avg_score'] = float(avg_score)
+
+    locations_sum = len(shapes_origin)
+    if locations_sum == 0:  # e.g. a burst / an early-exit chunk without any face (a cutaway, a title card).
+        return no_landmarks
+    if len(face_size_ori_s) == 0:  # A face in a single frame, no former face to compare it with.
+        face_size_ori_s.append(calculate_face_size(shapes_origin[0]))
+    stable_face_size = int(np.rint(np.average(face_size_ori_s)))
+    if locations_sum != frames_num:
+        print("Warning: Failed to detect the first {} frames, which will be skipped".format(skipped))
 
     """
     If us visualization, write the results to the visualize output folder.
     """
-    if locations_sum != frames_num:
-        print("Warning: Failed to detect the first {} frames, which will be skipped".format(skipped))
     if shared.use_visualization:
         fourcc = cv2.VideoWriter_fourcc('X', 'V', 'I', 'D')
-        frame_size = (frames[0].shape[1], frames[0].shape[0])
+        frame_size = (frame_width, frame_height)
         origin_video = cv2.VideoWriter(join(shared.visualize_path, video + "_origin.avi"),
                                        fourcc, fps, frame_size)
         track_video = cv2.VideoWriter(join(shared.visualize_path, video + "_track.avi"),
                                       fourcc, fps, frame_size)
 
-        print("Visualizing")
-        for i in tqdm(range(frames_num)):
-            if i < skipped:
-                # Skip the beginning frames
-                continue
-            frame_origin = frames[i].copy()
-            frame_track = frames[i].copy()
-            shape_origin = shapes_origin[i - skipped]
-            para_shift = shapes_para[i - skipped][0:2]
-            para_scale = shapes_para[i - skipped][2]
-            shape_track = np.rint(locations_track[i - skipped] / para_scale + para_shift).astype(int)
-            for (x, y) in shape_origin:
+    """
+    Calibration module.
+        - Crop and normalize each face, then track it from the former normalized face.
+    """
+    calibrated_normalized_landmarks = np.empty((locations_sum, num_pts * 2), dtype=np.float32)
+    face_prev, location_prev, merge_prev = None, None, None
+    P_predict = np.array([0] * num_pts).reshape(num_pts).astype(float)
+    lk_params = dict(winSize=(15, 15),
+                     maxLevel=3,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    center_prev = None
+    print("Tracking")
+    frames_iter = open_frames()
+    for _ in range(skipped):
+        if next(frames_iter, None) is None:  # The second decode ended before the first detected face.
+            break
+    tracked = 0  # Number of rows of [calibrated_normalized_landmarks] which have been filled.
+    for i, (frame, shape) in enumerate(tqdm(zip(frames_iter, shapes_origin), total=locations_sum)):
+        face, face_size, center_curr = shape_to_face(shape, frame_width, frame_height, 1.2,
+                                                     assign_face_size=stable_face_size,
+                                                     shift_threshold=1.42,
+                                                     center_prev=center_prev)
+        center_prev = center_curr
+        faceFrame = frame[face[1]: face[3],
+                    face[0]:face[2]]
+        # LK only needs the intensity: convert once, before the resize. Each face then goes through the pyramid
+        # and gradient computation of two `calcOpticalFlowPyrLK` calls on a single channel instead of three.
+        if faceFrame.ndim == 3:
+            faceFrame = cv2.cvtColor(faceFrame, cv2.COLOR_BGR2GRAY)
+        if face_size < face_size_normalized:
+            inter_para = cv2.INTER_CUBIC
+        else:
+            inter_para = cv2.INTER_AREA
+        face_norm = cv2.resize(faceFrame, (face_size_normalized, face_size_normalized), interpolation=inter_para)
+        scale_shape = face_size_normalized / face_size
+        shape_norm = np.rint((shape - np.array([face[0], face[1]])) * scale_shape).astype(int)
+
+        if i == 0:
+            merge_pt = shape_norm
+        else:
+            faces_seg = [face_prev, face_norm]
+            locations_seg = [location_prev, shape_norm]
+            # ----------------------------------------------------------------------#
+            """
+            Numpy Version (DEPRECATED)
+            """
+
+            # locations_track_start = [locations_track[-1]]
+            # forward_pts, feedback_pts = track_bidirectional(faces_seg, locations_track_start)
+            #
+            # forward_pts = np.rint(forward_pts).astype(int)
+            # feedback_pts = np.rint(feedback_pts).astype(int)
+            # merge_pt, check, P_predict = check_and_merge(locations_seg, forward_pts, feedback_pts, P_predict)
+
+            # ----------------------------------------------------------------------#
+            """
+            OpenCV Version
+            """
+
+            # Use the tracked current location as input. Also use the next frame's predicted location for
+            # auxiliary initialization.
+
+            start_pt = merge_prev.astype(np.float32)
+            target_pt = locations_seg[1].astype(np.float32)
+
+            forward_pt, status_fw, err_fw = cv2.calcOpticalFlowPyrLK(faces_seg[0], faces_seg[1],
+                                                                     start_pt, target_pt, **lk_params,
+                                                                     flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
+            feedback_pt, status_fb, err_fb = cv2.calcOpticalFlowPyrLK(faces_seg[1], faces_seg[0],
+                                                                      forward_pt, start_pt, **lk_params,
+                                                                      flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
+
+            forward_pts = [merge_prev.copy(), forward_pt]
+            feedback_pts = [feedback_pt, forward_pt.copy()]
+
+            forward_pts = np.rint(forward_pts).astype(int)
+            feedback_pts = np.rint(feedback_pts).astype(int)
+
+            merge_pt, check, P_predict = check_and_merge(locations_seg, forward_pts, feedback_pts, P_predict, status_fw,
+                                                         status_fb)
+
+            # ----------------------------------------------------------------------#
+
+        calibrated_normalized_landmarks[i] = merge_pt.ravel()
+        face_prev, location_prev, merge_prev = face_norm, shape_norm, merge_pt
+        tracked = i + 1
+
+        if shared.use_visualization:
+            frame_origin = frame.copy()
+            frame_track = frame.copy()
+            shape_track = np.rint(merge_pt / scale_shape + [face[0], face[1]]).astype(int)
+            for (x, y) in shape:
                 cv2.circle(frame_origin, (x, y), 3, (0, 0, 255), -1)
             for (x, y) in shape_track:
                 cv2.circle(frame_track, (x, y), 3, (0, 255, 0), -1)
             origin_video.write(frame_origin)
             track_video.write(frame_track)
+
+    if shared.use_visualization:
         origin_video.release()
         track_video.release()
 
+    if tracked != locations_sum:
+        # The second decode returned fewer frames than the first one (e.g. a truncated / damaged stream).
+        # Keep only the tracked faces: the remaining rows of the buffer were never written.
+        print("Warning: Only {} of the {} detected faces could be re-read for tracking".format(tracked,
+                                                                                            locations_sum))
+        calibrated_normalized_landmarks = calibrated_normalized_landmarks[:tracked]
+
     # -------------------------------------------#
     """
     Landmark Alignment (DEPRECATED)
@@ -403,13 +666,8 @@ def detect_frames_track(frames, video, fps):
         - Target: [-1, 1]
         - Updated at 2022/10/21
     """
-    calibrated_normalized_landmarks = []
-    for i in locations_track:
-        normalized_base = face_size_normalized // 2
-        shape = i - [normalized_base, normalized_base]
-        shape = shape / normalized_base
-        shape = shape.ravel()
-        shape = shape.tolist()
-        calibrated_normalized_landmarks.append(shape)
+    normalized_base = face_size_normalized // 2
+    calibrated_normalized_landmarks -= normalized_base
+    calibrated_normalized_landmarks /= normalized_base
 
     return calibrated_normalized_landmarks
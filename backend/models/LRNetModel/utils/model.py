@@ -77,3 +77,24 @@ class LRNet(nn.Module):
         x = self.dense(x)
         x = self.output(x)
         return x
+
+
+class LRNetEnsemble(nn.Module):
+    """
+    The two-stream classifier fused into one module:
+        - g1 reads the landmark blocks, g2 the frame-to-frame differences of the same blocks (computed here).
+        - The output is the average of both "fake" probabilities.
+    A single module can be traced and exported as one TorchScript / ONNX graph.
+    """
+    def __init__(self, g1: LRNet, g2: LRNet):
+        super(LRNetEnsemble, self).__init__()
+        self.g1 = g1
+        self.g2 = g2
+
+    def forward(self, x):
+        """
+        :param x: Landmark blocks [Shape: (B, block, 136)]
+        :return: Fake score of each block [Shape: (B,)]
+        """
+        x_diff = x[:, 1:, :] - x[:, :-1, :]
+        return (self.g1(x)[:, 1] + self.g2(x_diff)[:, 1]) / 2
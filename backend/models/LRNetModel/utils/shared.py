@@ -1,6 +1,21 @@
 # To store global variables
+import os
 
 face_detector_selection = 'blazeface'
 use_visualization = False
 visualize_path = './visualize'
 log_file = 'landmark_logs.txt'
+detector_pool_size = int(os.environ.get('LRNET_DETECTOR_POOL_SIZE', 1))  # Number of warm detectors per worker
+landmark_batch_size = int(os.environ.get('LRNET_LANDMARK_BATCH_SIZE', 8))  # Frames per landmark forward pass
+detect_max_size = int(os.environ.get('LRNET_DETECT_MAX_SIZE', 0))  # Longer side of the face detection input, 0 for native
+detect_interval = int(os.environ.get('LRNET_DETECT_INTERVAL', 1))  # Run the face detector every K frames, 1 for all
+redetect_score = float(os.environ.get('LRNET_REDETECT_SCORE', 0.5))  # Re-detect when the tracked landmarks score below
+frame_sampling = os.environ.get('LRNET_FRAME_SAMPLING', 'head')  # 'head': the first frames, 'bursts': spread over the video
+frame_source = os.environ.get('LRNET_FRAME_SOURCE', 'opencv')  # Video decoder: 'opencv' or 'pyav'
+decode_max_size = int(os.environ.get('LRNET_DECODE_MAX_SIZE', 0))  # Longer side of the decoded frames, 0 for native
+block_stride = int(os.environ.get('LRNET_BLOCK_STRIDE', 0))  # Frames between two LRNet blocks, 0 for the block size
+early_exit = os.environ.get('LRNET_EARLY_EXIT', '0') == '1'  # Stop tracking once the block votes are decisive
+early_exit_alpha = float(os.environ.get('LRNET_EARLY_EXIT_ALPHA', 0.05))  # Error rate accepted by the early exit test
+early_exit_vote_accuracy = float(os.environ.get('LRNET_EARLY_EXIT_VOTE_ACCURACY', 0.8))  # Assumed for one block vote
+early_exit_chunk = int(os.environ.get('LRNET_EARLY_EXIT_CHUNK', 0))  # Frames tracked between two tests, 0 for the block
+detect_workers = int(os.environ.get('LRNET_DETECT_WORKERS', 0))  # Processes detecting the frames of a video, 0 for none
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(os.getcwd(), "cache", "results.sqlite3"))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 100000))
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for data in iter(lambda: file.read(block_size), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-level cache of the video classification results, persisted in SQLite.
+        - tweet id -> result: skips the download and the whole pipeline.
+        - SHA-256 of the downloaded video -> result: the same clip re-uploaded under another tweet.
+    The keys include the `version` of the model, so the results of former weights are never served after a reload
+    (they age out with the TTL / LRU eviction).
+    Entries expire after `ttl` seconds, the least recently used ones are evicted beyond `max_entries`.
+    """
+    def __init__(self, path=RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 version=None):
+        """
+        :param version: Callable returning the current model version (str), None for unversioned keys
+        """
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"tweet_hits": 0, "tweet_misses": 0, "hash_hits": 0, "hash_misses": 0}
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self._db.commit()
+
+    def get_tweet(self, tweet_id):
+        return self._get(self._key("tweet", tweet_id), "tweet")
+
+    def get_video(self, sha256):
+        return self._get(self._key("sha256", sha256), "hash")
+
+    def set_tweet(self, tweet_id, result):
+        self._set(self._key("tweet", tweet_id), result)
+
+    def set_video(self, sha256, result):
+        self._set(self._key("sha256", sha256), result)
+
+    def clear_tweets(self):
+        """
+        Drop the tweet id -> result level, e.g. after re-scoring the videos: the next request of each tweet goes
+        through the (updated) video hash level.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE key LIKE 'tweet:%'")
+            self._db.commit()
+
+    def _key(self, level, key):
+        if self.version is None:
+            return f"{level}:{key}"
+        return f"{level}:{self.version()}:{key}"
+
+    def get_stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return dict(self.stats, entries=entries)
+
+    def _get(self, key, level):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.stats[f"{level}_misses"] += 1
+                return None
+            self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.stats[f"{level}_hits"] += 1
+        return json.loads(row[0])
+
+    def _set(self, key, result):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now))
+            overflow = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                    (overflow,))
+            self._db.commit()
@@ -0,0 +1,105 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+IO_WORKERS = int(os.environ.get("IO_WORKERS", 16))
+IO_MAX_PENDING = int(os.environ.get("IO_MAX_PENDING", 64))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 2))
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", 8))
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "process")  # 'process' or 'thread'
+
+
+class ExecutorFullError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    An executor with a limit on the number of queued + running tasks.
+        - `run` is for coroutines: raise ExecutorFullError when saturated, so the request can be answered with 429.
+        - `call` is for worker threads (e.g. the video job pool): block until a slot is free.
+    The underlying executor is created on first use, so importing the app does not start anything.
+    """
+    def __init__(self, name, make_executor, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self._make_executor = make_executor
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._make_executor()
+        return self._executor
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorFullError(f"{self.name} executor is saturated ({self.max_pending} pending tasks)")
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    def call(self, fn, *args):
+        with self._slots:
+            return self._get_executor().submit(fn, *args).result()
+
+    def warmup(self, fn, count):
+        """
+        Run `count` tasks at once, so a process executor starts all of its workers (and runs their initializer)
+        instead of waiting for the first requests.
+        """
+        executor = self._get_executor()
+        for future in [executor.submit(fn) for _ in range(count)]:
+            future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _init_inference_worker(batcher_address):
+    # Each inference process keeps its own warm detectors. LRNet runs in the main process only, which batches the
+    # blocks of all the inference processes together (see `inference_batcher.py`).
+    from models.LRNetModel.inference_batcher import connect
+    from models.LRNetModel.utils.detector_pool import init_detector_pool
+    connect(batcher_address)
+    init_detector_pool()
+
+
+def _warm_inference_worker():
+    return os.getpid()
+
+
+def warm_inference_executor():
+    """
+    Process mode: start the inference processes and wait until they are ready. Blocking, called at startup.
+    """
+    if INFERENCE_EXECUTOR == "thread":
+        return
+    inference_executor.warmup(_warm_inference_worker, INFERENCE_WORKERS)
+    logger.info(f"已預熱 {INFERENCE_WORKERS} 個推論進程")
+
+
+def _make_inference_executor():
+    if INFERENCE_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+    from models.LRNetModel.inference_batcher import serve
+    # 'spawn': forking a process that already runs torch threads may deadlock.
+    return ProcessPoolExecutor(max_workers=INFERENCE_WORKERS,
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_inference_worker,
+                               initargs=(serve(),))
+
+
+io_executor = BoundedExecutor(
+    "io", lambda: ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io"), IO_MAX_PENDING)
+inference_executor = BoundedExecutor("inference", _make_inference_executor, INFERENCE_MAX_PENDING)
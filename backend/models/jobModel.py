@@ -0,0 +1,109 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("VIDEO_JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.environ.get("VIDEO_JOB_MAX_PENDING", 32))
+JOB_TTL_SECONDS = int(os.environ.get("VIDEO_JOB_TTL_SECONDS", 3600))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex
+        self.status = "queued"  # queued -> running -> done / failed
+        self.stage = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def update(self, stage, progress):
+        self.stage = stage
+        self.progress = progress
+        self.updated_at = time.time()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    In-memory job queue backed by a bounded thread pool.
+    Finished jobs are kept for `ttl` seconds so that clients can poll their result.
+    """
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl=JOB_TTL_SECONDS):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="video-job")
+        self._jobs = {}
+        self._active = {}  # key -> queued / running job
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None):
+        """
+        Run `fn(*args, progress=job.update)` in the pool.
+        :param key: Jobs submitted with the key of a queued / running job share that job instead of running again.
+        :raise QueueFullError: when `max_pending` jobs are already queued or running.
+        """
+        with self._lock:
+            if key is not None and key in self._active:
+                logger.info(f"合併重複任務: {key}")
+                return self._active[key]
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise QueueFullError(f"Too many pending jobs: {pending}")
+            job = Job()
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._active[key] = job
+        self._executor.submit(self._run, job, fn, args, key)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, key):
+        job.status = "running"
+        job.update("running", 0.0)
+        try:
+            job.result = fn(*args, progress=job.update)
+            job.status = "done"
+            job.update("done", 1.0)
+        except Exception as e:
+            logger.exception(f"任務 {job.job_id} 失敗: {str(e)}")
+            job.error = getattr(e, "detail", None) or str(e)
+            job.status = "failed"
+            job.update("failed", job.progress)
+        finally:
+            if key is not None:
+                with self._lock:
+                    self._active.pop(key, None)
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in ("done", "failed") and now - job.updated_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
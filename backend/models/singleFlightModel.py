@@ -0,0 +1,29 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls with the same key: the first caller runs the coroutine, the concurrent
+    duplicates await the same future. The key is released as soon as the call finishes, so results are not
+    cached here.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+
+    async def do(self, key, fn, *args):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.info(f"{self.name}: 合併重複請求 {key}")
+        # Shield: a disconnected client must not cancel the work shared with the others.
+        return await asyncio.shield(future)
+
+    def inflight(self):
+        return len(self._inflight)
@@ -0,0 +1,19 @@
+from typing import Optional
+from fastapi import APIRouter, Response
+from controllers.modelController import reload_lrnet_models, get_model_status, reclassify_stored_videos
+
+router = APIRouter()
+
+@router.get("/models")
+async def model_status_route():
+    return get_model_status()
+
+@router.post("/models/reload")
+async def model_reload_route(weights_g1: Optional[str] = None, weights_g2: Optional[str] = None):
+    return await reload_lrnet_models(weights_g1, weights_g2)
+
+@router.post("/models/reclassify")
+async def model_reclassify_route(response: Response):
+    # Re-score the stored landmarks with the current weights, e.g. after POST /models/reload.
+    response.status_code = 202
+    return reclassify_stored_videos()
@@ -1,6 +1,6 @@
 import logging
-from fastapi import APIRouter, Response, HTTPException
-from controllers.videoController import extract_video_content_by_id
+from fastapi import APIRouter, Response
+from controllers.videoController import submit_video_job, get_video_job, get_video_cache_stats
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -8,14 +8,17 @@ router = APIRouter()
 
 @router.post("/videoDetect")
 async def video_detect_route(response: Response, video_id: str):
-    try:
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        logger.info(f"Processing video with ID: {video_id}")
-        
-        video_content = await extract_video_content_by_id(video_id)
-        
-        logger.info(f"Video content extracted successfully for ID: {video_id}")
-        return video_content
-    except Exception as e:
-        logger.error(f"Error processing video ID {video_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    logger.info(f"Queueing video with ID: {video_id}")
+    # Returns immediately, poll GET /videoDetect/{job_id} for the result.
+    response.status_code = 202
+    return submit_video_job(video_id)
+
+@router.get("/videoCache")
+async def video_cache_stats_route():
+    return get_video_cache_stats()
+
+@router.get("/videoDetect/{job_id}")
+async def video_detect_status_route(response: Response, job_id: str):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return get_video_job(job_id)
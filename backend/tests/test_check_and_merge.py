@@ -0,0 +1,126 @@
+import sys
+import pathlib
+import numpy as np
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(pathlib.Path(__file__).parent.parent.as_posix())
+
+from models.LRNetModel.utils.landmark_utils import check_and_merge
+
+"""
+The vectorized `check_and_merge` must stay bit-identical to its former per-point loops, kept here as the reference.
+"""
+
+NUM_PTS = 68
+
+
+def check_and_merge_loop(location, forward, feedback, P_predict, status_fw=None, status_fb=None):
+    num_pts = 68
+    check = [True] * num_pts
+
+    target = location[1]
+    forward_predict = forward[1]
+
+    forward_base = forward[0]
+    feedback_predict = feedback[0]
+    feedback_diff = feedback_predict - forward_base
+    feedback_dist = np.linalg.norm(feedback_diff, axis=1, keepdims=True)
+
+    detect_diff = location[1] - location[0]
+    detect_dist = np.linalg.norm(detect_diff, axis=1, keepdims=True)
+    predict_diff = forward[1] - forward[0]
+    predict_dist = np.linalg.norm(predict_diff, axis=1, keepdims=True)
+    predict_dist[np.where(predict_dist == 0)] = 1
+    P_detect = (detect_dist / predict_dist).reshape(num_pts)
+
+    for ipt in range(num_pts):
+        if feedback_dist[ipt] > 2:
+            check[ipt] = False
+
+    if status_fw is not None and np.sum(status_fw) != num_pts:
+        for ipt in range(num_pts):
+            if status_fw[ipt][0] == 0:
+                check[ipt] = False
+    if status_fw is not None and np.sum(status_fb) != num_pts:
+        for ipt in range(num_pts):
+            if status_fb[ipt][0] == 0:
+                check[ipt] = False
+    location_merge = target.copy()
+
+    Q = 0.3
+    for ipt in range(num_pts):
+        if check[ipt]:
+            P_predict[ipt] += Q
+            K = P_predict[ipt] / (P_predict[ipt] + P_detect[ipt])
+            location_merge[ipt] = forward_predict[ipt] + K * (target[ipt] - forward_predict[ipt])
+            P_predict[ipt] = (1 - K) * P_predict[ipt]
+    return location_merge, check, P_predict
+
+
+def random_case(rng, zero_motion=0.0, failed=0.0, with_status=True):
+    """
+    Integer landmark locations as produced by the tracker, with a fraction of the points not moving (forward
+    tracking) and a fraction of failed optical flow statuses.
+    """
+    location_prev = rng.randint(0, 400, (NUM_PTS, 2))
+    location = np.stack([location_prev, location_prev + rng.randint(-6, 7, (NUM_PTS, 2))])
+    forward_curr = location_prev + rng.randint(-6, 7, (NUM_PTS, 2))
+    still = rng.rand(NUM_PTS) < zero_motion
+    forward_curr[still] = location_prev[still]
+    forward = np.stack([location_prev, forward_curr])
+    feedback = np.stack([location_prev + rng.randint(-3, 4, (NUM_PTS, 2)), forward_curr])
+    P_predict = rng.rand(NUM_PTS) * 2
+    if not with_status:
+        return location, forward, feedback, P_predict, None, None
+    status_fw = (rng.rand(NUM_PTS, 1) >= failed).astype(np.uint8)
+    status_fb = (rng.rand(NUM_PTS, 1) >= failed).astype(np.uint8)
+    return location, forward, feedback, P_predict, status_fw, status_fb
+
+
+def assert_same(case):
+    location, forward, feedback, P_predict, status_fw, status_fb = case
+    expected = check_and_merge_loop(location, forward, feedback, P_predict.copy(), status_fw, status_fb)
+    actual = check_and_merge(location, forward, feedback, P_predict.copy(), status_fw, status_fb)
+    assert actual[0].dtype == expected[0].dtype
+    assert np.array_equal(actual[0], expected[0])
+    assert np.array_equal(np.asarray(actual[1]), np.asarray(expected[1]))
+    assert np.array_equal(actual[2], expected[2])  # Bit-identical, not only close
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random(seed):
+    assert_same(random_case(np.random.RandomState(seed)))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_zero_motion(seed):
+    assert_same(random_case(np.random.RandomState(seed), zero_motion=0.5))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_failed_status(seed):
+    assert_same(random_case(np.random.RandomState(seed), failed=0.2))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_without_status(seed):
+    assert_same(random_case(np.random.RandomState(seed), with_status=False))
+
+
+def test_all_points_still_and_failed():
+    rng = np.random.RandomState(0)
+    assert_same(random_case(rng, zero_motion=1.0, failed=1.0))
+    assert_same(random_case(rng, zero_motion=1.0))
+
+
+def test_recursive_over_frames():
+    # P_predict is carried over the frames: the two versions must not drift apart.
+    rng = np.random.RandomState(1)
+    P_loop, P_vec = np.zeros(NUM_PTS), np.zeros(NUM_PTS)
+    for _ in range(100):
+        location, forward, feedback, _, status_fw, status_fb = random_case(rng, zero_motion=0.1, failed=0.05)
+        merge_loop, _, P_loop = check_and_merge_loop(location, forward, feedback, P_loop, status_fw, status_fb)
+        merge_vec, _, P_vec = check_and_merge(location, forward, feedback, P_vec, status_fw, status_fb)
+        assert np.array_equal(merge_loop, merge_vec)
+        assert np.array_equal(P_loop, P_vec)